@@ -6,19 +6,23 @@ Desc: yolov5检测器
 Author: gaoy
 Time: 2023/8/4
 """
+import cv2
+import time
 import torch
 import numpy as np
-from models.experimental import attempt_load
-from utils.general import non_max_suppression, scale_coords
-from utils.torch_utils import select_device
-from utils.datasets import letterbox
+from models.backends import load_backend
+from utils.general import fast_non_max_suppression, scale_coords, make_divisible
+from utils.torch_utils import time_synchronized
+from tools import detections
+from tools.device_policy import resolve_device, resolve_precision
 
 
 class Detector:
     """
     yolov5检测器
     """
-    def __init__(self, cfg_model, threshold = 0.25, stride = 32, img_size = 1280):
+    def __init__(self, cfg_model, threshold = 0.25, stride = 32, img_size = 1280, preprocess_cache = None,
+                 detection_cache = None):
         """
         初始化函数
         Args: 
@@ -26,11 +30,33 @@ class Detector:
             threshold: 置信度阈值
             stride: 移动步长
             img_size: 新图片尺寸
+            preprocess_cache: 多个检测器共享的预处理缓存(tools/preprocess_cache.py), 同一帧同一尺寸只缩放一次
+            detection_cache: 近重复帧检测结果缓存(tools/detection_cache.py), 命中的帧不再推理
         """
         self.img_size = img_size
+        self.preprocess_cache = preprocess_cache
+        self.detection_cache = detection_cache
         self.threshold = threshold
         self.stride = stride
         self.cfg_model = cfg_model
+        self.buffers = {}  # 预分配输入缓冲区, k=(h, w), v=(host uint8 NCHW, device 归一化张量)
+        #切块推理: 长边不小于 MIN_SIDE 的帧切成重叠的块, 与整帧一起作为一批推理, 再跨块合并
+        cfg_tiling = cfg_model.get("TILING", {})
+        self.tiling = cfg_tiling.get("ENABLE", False)
+        self.tile_min_side = cfg_tiling.get("MIN_SIDE", 1920)
+        self.tile_size = cfg_tiling.get("TILE", 640)
+        self.tile_overlap = cfg_tiling.get("OVERLAP", 0.2)
+        self.tile_merge_thres = cfg_tiling.get("MERGE_THRES", 0.6)
+        self.tile_cache = {}  # k=(h, w), v=块坐标列表
+        #NMS 实现: auto(依次尝试 torchvision/cython/numpy)/torchvision/cython/numpy
+        self.nms_engine = cfg_model.get("NMS", "auto")
+        #NMS 前每张图只保留置信度最高的 NMS_TOPK 个候选框
+        self.nms_topk = cfg_model.get("NMS_TOPK", 1000)
+        #分阶段耗时(毫秒), 每批推理后更新: preprocess/forward/candidates/nms/postprocess; 每阶段需同步 GPU, 默认关闭
+        self.stage_timings = cfg_model.get("STAGE_TIMINGS", False)
+        self.timings = {}
+        self.inferred = 0  # 上一批实际推理的图片数, 近重复帧缓存命中的不计
+        self.warm = set()  # 已预热的 (帧尺寸, 推理尺寸, 批大小)
         super(Detector, self).__init__()
         self.init_model()
         
@@ -39,14 +65,123 @@ class Detector:
         初始化模型函数
         """
         self.weights = self.cfg_model["WEIGHTS"]
-        self.device = self.cfg_model["DEVICE"]
-        self.device = select_device(self.device)
-        model = attempt_load(self.weights, map_location=self.device)
-        model.to(self.device).eval() 
-        model.half()
+        self.device = resolve_device(self.cfg_model.get("DEVICE", "cpu"))
+        #精度: GPU 默认 fp16, CPU 默认 fp32, 可配置 bf16/int8
+        self.precision = resolve_precision(self.cfg_model.get("PRECISION", "auto"), self.device)
+        #推理后端: torch(.pt) / torchscript / onnxruntime, 共用同一套前后处理
+        self.backend = self.cfg_model.get("BACKEND", "torch")
+        cfg_threads = self.cfg_model.get("THREADS", {})
+        #融合并转换精度后的模型缓存目录(按权重哈希区分), 重启时跳过 fuse
+        t0 = time.time()
+        model = load_backend(self.backend, self.weights, self.device, precision=self.precision,
+                             names=self.cfg_model.get("NAMES"),
+                             threads=(cfg_threads.get("INTRA_OP"), cfg_threads.get("INTER_OP")),
+                             cache_dir=self.cfg_model.get("CACHE_DIR"))
+        self.load_time = time.time() - t0  # 模型载入耗时(秒)
+        self.cache_hit = model.cache_hit  # 是否命中缓存, 未配置缓存或非 torch 后端为 None
+        self.dtype = model.dtype  # 输入张量精度, 与模型一致
         self.m = model
-        self.names = model.module.names if hasattr(
-            model, 'module') else model.names
+        self.names = model.names
+        #只检测这些类别(类别名), 最高分类别不在其中的框在 NMS 前丢弃
+        classes = self.cfg_model.get("CLASSES")
+        self.classes = [self.names.index(c) for c in classes] if classes else None
+        #裁剪检测头: 只保留这些类别的输出通道, 解码/NMS 的数据量随之减小(仅 torch 后端)
+        if self.classes and self.cfg_model.get("PRUNE_HEAD", False):
+            assert hasattr(model, 'prune'), '{} 后端不支持裁剪检测头, 请导出时使用 models/export.py --classes'.format(self.backend)
+            model.prune(self.classes)
+            self.classes = None  # 剩余类别即所需类别
+            self.names = model.names
+        self.names_arr = np.array(self.names, dtype=detections.DET_DTYPE['lbl'])
+
+    def get_buffers(self, n, h, w):
+        """
+        获取预分配的输入缓冲区, 容量不足或尺寸变化时才重新分配
+        Args:
+            n: 批大小
+            h, w: 推理尺寸
+        Returns:
+            host: uint8 NCHW 缓冲区(cuda 下为锁页内存)
+            dev: 设备上归一化后的输入张量
+        """
+        if (h, w) not in self.buffers or self.buffers[(h, w)][0].shape[0] < n:
+            pin = self.device.type == 'cuda'
+            host = torch.empty((n, 3, h, w), dtype=torch.uint8, pin_memory=pin)
+            dev = torch.empty((n, 3, h, w), dtype=self.dtype, device=self.device)
+            self.buffers[(h, w)] = (host, dev)
+        host, dev = self.buffers[(h, w)]
+        return host[:n], dev[:n]
+
+    def tile_boxes(self, shape):
+        """
+        按块边长与重叠比例切块, 末块与图像边缘对齐
+        Args:
+            shape: 图像尺寸
+        Returns:
+            块坐标列表 [(x0, y0, x1, y1), ...]
+        """
+        h, w = shape[:2]
+        if (h, w) not in self.tile_cache:
+            t = self.tile_size
+            step = max(1, int(t * (1 - self.tile_overlap)))
+            starts = lambda n: [0] if n <= t else list(range(0, n - t, step)) + [n - t]
+            self.tile_cache[(h, w)] = [(x, y, min(x + t, w), min(y + t, h)) for y in starts(h) for x in starts(w)]
+        return self.tile_cache[(h, w)]
+
+    @staticmethod
+    def to_chw(frame, uw, uh):
+        """
+        缩放到 (uw, uh) 并转为连续的 RGB CHW uint8 图像, 存入预处理缓存
+        """
+        if frame.shape[1::-1] != (uw, uh):
+            frame = cv2.resize(frame, (uw, uh), interpolation=cv2.INTER_LINEAR)
+        return np.ascontiguousarray(frame.transpose(2, 0, 1)[::-1])
+
+    def preprocess_batch(self, frames, ref_shapes=None, img_sizes=None, keys=None):
+        """
+        批量图片预处理函数: 各图等比缩放后居中填入同一个 uint8 NCHW 缓冲区,
+        BGR->RGB 与 HWC->CHW 在写入缓冲区时一次完成, 上传后一次运算完成类型转换与归一化.
+        Args:
+            frames: 传入的图片列表(BGR, HWC), 不会被修改
+            ref_shapes: 按这些尺寸计算缩放比, 默认为各图自身尺寸. ROI 裁剪图传入整帧尺寸,
+                使其与整帧推理的缩放比相同, 输入随裁剪区域变小
+            img_sizes: 每张图的推理尺寸, 默认 self.img_size
+            keys: 每张图在预处理缓存中的键(帧存活期间唯一), None 为不使用缓存
+        Returns:
+            img: 设备上的输入张量(n, 3, h, w)
+            ratio_pads: 每张图的 (缩放比, 填充), 用于 scale_coords 还原坐标
+        """
+        shapes = [frame.shape[:2] for frame in frames]
+        ref_shapes = [s[:2] for s in ref_shapes] if ref_shapes else shapes
+        img_sizes = img_sizes or [self.img_size] * len(frames)
+        if self.m.input_shape:  # 导出时固定了输入尺寸的模型
+            h, w = self.m.input_shape
+            ratios = [min(h / h0, w / w0) for h0, w0 in ref_shapes]
+            unpads = [(int(round(w0 * r)), int(round(h0 * r))) for (h0, w0), r in zip(shapes, ratios)]
+        else:
+            ratios = [min(s / h0, s / w0) for (h0, w0), s in zip(ref_shapes, img_sizes)]
+            unpads = [(int(round(w0 * r)), int(round(h0 * r))) for (h0, w0), r in zip(shapes, ratios)]
+            h = make_divisible(max(uh for _, uh in unpads), self.stride)  # 覆盖整批的最小矩形
+            w = make_divisible(max(uw for uw, _ in unpads), self.stride)
+
+        host, dev = self.get_buffers(len(frames), h, w)
+        host_np = host.numpy()
+        host_np.fill(114)
+        ratio_pads = []
+        keys = keys if self.preprocess_cache is not None and keys else [None] * len(frames)
+        for i, (frame, r, (uw, uh), key) in enumerate(zip(frames, ratios, unpads, keys)):
+            top, left = int(round((h - uh) / 2 - 0.1)), int(round((w - uw) / 2 - 0.1))
+            if key is not None:  # 其他模型可能已处理过同一帧同一尺寸
+                host_np[i, :, top:top + uh, left:left + uw] = self.preprocess_cache.get(
+                    (key, uw, uh), lambda: self.to_chw(frame, uw, uh))
+            else:
+                if frame.shape[1::-1] != (uw, uh):
+                    frame = cv2.resize(frame, (uw, uh), interpolation=cv2.INTER_LINEAR)
+                host_np[i, :, top:top + uh, left:left + uw] = frame.transpose(2, 0, 1)[::-1]  # HWC BGR to CHW RGB
+            ratio_pads.append(((r, r), (left, top)))
+
+        img = host.to(self.device, non_blocking=True)
+        torch.div(img, 255.0, out=dev)  # uint8 -> 模型精度并归一化
+        return dev, ratio_pads
 
     def preprocess(self, img):
         """
@@ -54,16 +189,40 @@ class Detector:
         Args:
             img: 传入的图片
         """
-        img0 = img.copy()
-        img = letterbox(img, new_shape=self.img_size, stride=self.stride)[0]
-        img = img[:, :, ::-1].transpose(2, 0, 1)
-        img = np.ascontiguousarray(img)
-        img = torch.from_numpy(img).to(self.device)
-        img = img.half()  # 半精度
-        img /= 255.0  # 图像归一化
-        if img.ndimension() == 3:
-            img = img.unsqueeze(0)
-        return img0, img
+        img_batch, _ = self.preprocess_batch([img])
+        return img, img_batch
+
+    def postprocess(self, pred, im0_shapes, ratio_pads, offsets=None):
+        """
+        后处理函数(NMS+坐标还原)
+        Args:
+            pred: 模型输出
+            im0_shapes: 每张原图的尺寸
+            ratio_pads: 每张图的 (缩放比, 填充)
+            offsets: 每张图在整帧中的左上角 (x, y), ROI 裁剪图需平移回整帧坐标
+        Returns:
+            每张图的检测结果, 结构化数组(见 tools/detections.py)
+        """
+        timings = self.timings if self.stage_timings else None
+        pred = fast_non_max_suppression(pred.float(), self.threshold, 0.45, classes=self.classes, agnostic=True,
+                                        topk=self.nms_topk, engine=self.nms_engine, timings=timings)
+        t0 = time_synchronized() if timings is not None else 0
+        preds = []
+        offsets = offsets or [None] * len(pred)
+
+        for det, im0_shape, ratio_pad, offset in zip(pred, im0_shapes, ratio_pads, offsets):
+            if det is not None and len(det):
+                det[:, :4] = scale_coords(
+                    None, det[:, :4], im0_shape, ratio_pad=ratio_pad).round()
+                if offset is not None:
+                    det[:, [0, 2]] += offset[0]
+                    det[:, [1, 3]] += offset[1]
+                preds.append(detections.from_array(det.cpu().numpy(), self.names_arr))  # 每帧仅一次回传
+            else:
+                preds.append(detections.empty())
+        if timings is not None:
+            timings['postprocess'] = (time_synchronized() - t0) * 1000
+        return preds
 
     def detect(self, im):
         """
@@ -71,21 +230,120 @@ class Detector:
         Args:
             im: 传入的图片
         """
-        im0, img = self.preprocess(im)
-        pred = self.m(img, augment=False)[0]
-        pred = pred.float()
-        pred = non_max_suppression(pred, self.threshold, 0.45, agnostic=True)
-        pred_boxes = []
+        return self.detect_batch([im])[0]
 
-        for det in pred:
-            if det is not None and len(det):
-                det[:, :4] = scale_coords(
-                    img.shape[2:], det[:, :4], im0.shape).round()
-                for *x, conf, cls_id in det:
-                    lbl = self.names[int(cls_id)]
-                    x1, y1 = int(x[0]), int(x[1])
-                    x2, y2 = int(x[2]), int(x[3])
-                    pred_boxes.append(
-                        (x1, y1, x2, y2, lbl, conf))
-        return im, pred_boxes
+    @torch.no_grad()
+    def warmup(self, shape, img_size=None, batch_size=1):
+        """
+        用空白帧预热一种输入形状(分配输入缓冲区, cudnn 选择算法), 已预热过的形状直接跳过
+        Args:
+            shape: 帧尺寸 (h, w, c)
+            img_size: 推理尺寸, 默认 self.img_size
+            batch_size: 批大小
+        Returns:
+            耗时(秒), 已预热过则为 0
+        """
+        key = (tuple(shape), img_size or self.img_size, batch_size)
+        if key in self.warm:
+            return 0
+        t0 = time.time()
+        frames = [np.zeros(shape, dtype=np.uint8)] * batch_size
+        self.detect_batch(frames, img_sizes=[key[1]] * batch_size, dedup=False)
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        self.warm.add(key)
+        return time.time() - t0
+
+    def detect_dedup(self, ims, rois, img_sizes, keys, cameras):
+        """
+        近重复帧直接返回缓存的检测结果, 其余帧一批推理后存入缓存. 参数与返回值同 detect_batch
+        """
+        rois = rois or [None] * len(ims)
+        img_sizes = img_sizes or [self.img_size] * len(ims)
+        keys = keys or [None] * len(ims)
+        cameras = cameras or [None] * len(ims)
+        results, misses = [None] * len(ims), []
+        for i, (im, roi) in enumerate(zip(ims, rois)):
+            #各摄像头分开缓存(如夜间画面都很暗时不串用), 只比较推理区域, 结果随 ROI 过滤, 不同 ROI 不共用
+            region, group = im, (cameras[i], im.shape, img_sizes[i], None)
+            if roi is not None:
+                x0, y0, x1, y1 = roi.crop_box(im.shape)
+                region = im[y0:y1, x0:x1]
+                group = (cameras[i], im.shape, img_sizes[i], tuple(p.tobytes() for p in roi.polygons))
+            phash, dets = self.detection_cache.lookup(region, group)
+            if dets is not None:
+                results[i] = (im, dets)
+            else:
+                misses.append((i, phash, group))
+        if not misses:
+            self.timings = {}  # 本批未推理
+            self.inferred = 0
+            return results
+        idx = [i for i, _, _ in misses]
+        out = self.detect_batch([ims[i] for i in idx], [rois[i] for i in idx], [img_sizes[i] for i in idx],
+                                [keys[i] for i in idx], dedup=False)
+        for (i, phash, group), (im, dets) in zip(misses, out):
+            self.detection_cache.store(phash, group, dets)
+            results[i] = (im, dets)
+        return results
+
+    @torch.no_grad()
+    def detect_batch(self, ims, rois=None, img_sizes=None, keys=None, dedup=True, cameras=None):
+        """
+        yolov5批量推理函数, 多张图片一次前向+NMS
+        Args:
+            ims: 传入的图片列表
+            rois: 每张图的检测区域(tools/roi.py 的 Roi, 或 None), 只对区域外接矩形推理并丢弃区域外的框
+            开启切块推理时, 大图的各块与整图在同一批中推理
+            img_sizes: 每张图的推理尺寸, 默认 self.img_size
+            keys: 每张图的预处理缓存键(帧存活期间唯一), 多个检测器共享缓存时传入
+            dedup: 是否先查近重复帧检测结果缓存(需配置 detection_cache), 预热时关闭
+            cameras: 每张图所属摄像头, 近重复帧缓存按摄像头分开
+        Returns:
+            [(im, pred_boxes), ...], 与 ims 一一对应, pred_boxes 为结构化数组
+        """
+        if dedup and self.detection_cache is not None:
+            return self.detect_dedup(ims, rois, img_sizes, keys, cameras)
+        rois = rois or [None] * len(ims)
+        img_sizes = img_sizes or [self.img_size] * len(ims)
+        keys = keys or [None] * len(ims)
+        owners, crops, offsets, ref_shapes = [], [], [], []  # 每个推理输入所属的图片序号/裁剪视图/偏移/缩放参考尺寸
+        crop_keys = []  # 预处理缓存键: 帧键 + 裁剪区域
+        for i, (im, roi) in enumerate(zip(ims, rois)):
+            region, offset = im, None
+            if roi is not None:
+                x0, y0, x1, y1 = roi.crop_box(im.shape)
+                region, offset = im[y0:y1, x0:x1], (x0, y0)  # 视图, 不拷贝
+            if self.tiling and max(region.shape[:2]) >= self.tile_min_side:
+                ox, oy = offset or (0, 0)
+                for x0, y0, x1, y1 in self.tile_boxes(region.shape):
+                    owners.append(i)
+                    crops.append(region[y0:y1, x0:x1])
+                    offsets.append((ox + x0, oy + y0))
+                    ref_shapes.append((self.tile_size, self.tile_size))  # 各块同一缩放比
+                    crop_keys.append(keys[i] and (keys[i], offsets[-1], crops[-1].shape))
+            owners.append(i)  # 整帧(整个 ROI), 切块时负责跨块的大目标
+            crops.append(region)
+            offsets.append(offset)
+            ref_shapes.append(im.shape)
+            crop_keys.append(keys[i] and (keys[i], offset, region.shape))
+
+        t0 = time_synchronized() if self.stage_timings else 0
+        img, ratio_pads = self.preprocess_batch(crops, ref_shapes=ref_shapes, img_sizes=[img_sizes[i] for i in owners],
+                                                keys=crop_keys)
+        if self.stage_timings:
+            t1 = time_synchronized()
+            self.timings['preprocess'] = (t1 - t0) * 1000
+        pred = self.m(img)
+        if self.stage_timings:
+            self.timings['forward'] = (time_synchronized() - t1) * 1000
+        dets = self.postprocess(pred, [crop.shape for crop in crops], ratio_pads, offsets)
 
+        preds = [[] for _ in ims]
+        for i, det in zip(owners, dets):
+            preds[i].append(det)
+        preds = [parts[0] if len(parts) == 1 else detections.merge(np.concatenate(parts), self.tile_merge_thres)
+                 for parts in preds]
+        preds = [pred if roi is None else roi.filter(pred, im.shape) for im, roi, pred in zip(ims, rois, preds)]
+        self.inferred = len(ims)
+        return list(zip(ims, preds))
@@ -6,9 +6,11 @@ Desc: 主程序入口
 Author: gaoy
 Time: 2023/8/4
 """
+import time
+T_IMPORT = time.time()  # 启动计时起点
 import yaml
 import queue
-import time
+import multiprocessing as mp
 import traceback
 import json
 import logging
@@ -16,6 +18,10 @@ from tools.logger import setup_log
 from tools.cameras import Camera
 from tools.gpu_slaves import Gpuslave
 from tools.monitor import Monitor
+from tools.preprocess_cache import PreprocessCache
+from tools.device_policy import apply_threads, default_threads
+from tools.processing import camera_main, slave_main
+IMPORT_SECONDS = time.time() - T_IMPORT  # 模块导入耗时
 
 
 class Dect_App:
@@ -36,10 +42,16 @@ class Dect_App:
         logger.info('-'*10 + 'App Config' + '-'*10)
         logger.info(json.dumps(self.cfg))
 
+        #运行模式: threading 全部线程同进程; processing 摄像头/推理各自独立进程
+        self.mode = self.cfg.get('APP', {}).get('MODE', 'threading')
+        #端到端时延预算(毫秒), 超出预算的帧在各级被丢弃
+        self.latency_budget = self.cfg.get('APP', {}).get('LATENCY_BUDGET_MS')
         self.q_pic = {}
         self.exc_bucket = queue.Queue()
         self.gpu_slaves = {}
         self.cameras = {}
+        self.processes = []
+        self.q_results = {}
 
     def setup_cameras(self):
         """
@@ -53,15 +65,59 @@ class Dect_App:
                 cfg_camera=camera_cfg,
                 q_pic=self.q_pic,
                 exc_bucket=self.exc_bucket,
+                ring_slots=self.cfg['CAMERA'].get('RING_SIZE', 32),
+                max_reorder_ms=self.cfg['CAMERA'].get('MAX_REORDER_MS'),
+                latency_budget_ms=self.latency_budget,
             )
         for camera in self.cameras.values():
             camera.run()
 
-    def setup_gpu_slaves(self):
+    def setup_threads(self):
+        """
+        未配置线程数的 cpu 模型平分 cpu 核, 防止多个 slave 超额订阅.
+        线程数为进程级设置: processing 模式下各推理进程按本模型配置设置;
+        threading 模式下所有 slave 共用一份, 各模型配置不一致时告警并统一取最大值, 在此设置一次
+        """
+        cpu_slaves = [cfg for cfg in self.cfg['MODEL']['TYPES'].values() if str(cfg.get('DEVICE', 'cpu')).lower() == 'cpu']
+        n_slaves = sum(cfg.get('WORKERS', 1) if self.mode == 'processing' else 1 for cfg in cpu_slaves)
+        for model_cfg in cpu_slaves:
+            model_cfg.setdefault('THREADS', {}).setdefault('INTRA_OP', default_threads(n_slaves))
+        if self.mode == 'processing':
+            return
+        threads = {}
+        for key in ('INTRA_OP', 'INTER_OP'):
+            values = {name: cfg['THREADS'][key] for name, cfg in self.cfg['MODEL']['TYPES'].items()
+                      if cfg.get('THREADS', {}).get(key)}
+            if len(set(values.values())) > 1:
+                self.logger.warning('threading 模式下 {} 线程数为进程级设置, 各模型配置不一致({}), 统一使用 {}.'.format(
+                    key, values, max(values.values())))
+            threads[key] = max(values.values()) if values else None
+        apply_threads(threads['INTRA_OP'], threads['INTER_OP'])
+
+    def wait_ready(self, events: dict) -> bool:
         """
-        GPU模块启动函数
+        等待各推理模块载入模型并预热完成, 有模块启动失败(异常桶非空)时不再等待
+        Args:
+            events: k=模块名, v=就绪事件
+        """
+        t0 = time.time()
+        for name, event in events.items():
+            while not event.wait(timeout=1):
+                if not self.exc_bucket.empty():
+                    self.logger.error('{} 启动失败, 不再等待.'.format(name))
+                    return False
+            self.logger.info('{} ready ({:.1f}s).'.format(name, time.time() - t0))
+        return True
+
+    def setup_gpu_slaves(self) -> bool:
+        """
+        GPU模块启动函数, 返回是否全部就绪
         """
         self.logger.info('gpu slaves: preparing...')
+        self.setup_threads()
+        #多个模型共享预处理缓存, 同一帧同一推理尺寸只缩放一次
+        cache_size = self.cfg['MODEL'].get('PREPROCESS_CACHE', 64)
+        preprocess_cache = PreprocessCache(cache_size) if cache_size and len(self.cfg['MODEL']['TYPES']) > 1 else None
         for model_name, model_cfg in self.cfg['MODEL']['TYPES'].items():
             model_name = model_name.lower()
             self.q_pic[model_name] = queue.Queue(maxsize=50)
@@ -69,11 +125,53 @@ class Dect_App:
                 name=model_name,
                 q_pic_my=self.q_pic[model_name],
                 exc_bucket=self.exc_bucket,
-                cfg_model = model_cfg
+                cfg_model = model_cfg,
+                latency_budget_ms=self.latency_budget,
+                preprocess_cache=preprocess_cache,
             )
         for slave in self.gpu_slaves.values():
             slave.run()
-            time.sleep(1)
+        return self.wait_ready({'gpuslave({})'.format(name): slave.ready for name, slave in self.gpu_slaves.items()})
+
+    def setup_processes(self):
+        """
+        多进程模式启动函数: 每个模型启动 WORKERS 个推理进程, 全部就绪后每个摄像头启动一个进程, 帧经共享内存环传递
+        """
+        self.logger.info('processes: preparing...')
+        self.setup_threads()
+        ctx = mp.get_context('spawn')  # CUDA 要求 spawn
+        self.exc_bucket = ctx.Queue()
+        self.q_results = {name: ctx.Queue() for name in self.cfg['CAMERA']['DEVICES'].keys()}
+        ring_slots = self.cfg['CAMERA'].get('RING_SIZE', 32)
+
+        ready = {}
+        for model_name, model_cfg in self.cfg['MODEL']['TYPES'].items():
+            model_name = model_name.lower()
+            self.q_pic[model_name] = ctx.Queue(maxsize=50)
+            for worker in range(model_cfg.get('WORKERS', 1)):
+                name = 'slave-{}-{}'.format(model_name, worker)
+                ready[name] = ctx.Event()
+                self.start_process(ctx.Process(
+                    target=slave_main, name=name, daemon=True,
+                    args=(model_name, worker, model_cfg, self.q_pic[model_name], self.q_results, self.exc_bucket,
+                          self.latency_budget, ready[name])))
+        if not self.wait_ready(ready):
+            return
+
+        for camera_name, camera_cfg in self.cfg['CAMERA']['DEVICES'].items():
+            self.start_process(ctx.Process(
+                target=camera_main, name='camera-{}'.format(camera_name), daemon=True,
+                args=(camera_name, self.cfg['CAMERA']['FPS'], camera_cfg, self.q_pic,
+                      self.q_results[camera_name], self.exc_bucket, ring_slots,
+                      self.cfg['CAMERA'].get('MAX_REORDER_MS'), self.latency_budget)))
+
+    def start_process(self, process):
+        """
+        启动并记录子进程
+        """
+        process.start()
+        self.processes.append(process)
+        self.logger.info('process {} 启动, pid={}.'.format(process.name, process.pid))
 
     def setup_monitor(self):
         """
@@ -83,7 +181,7 @@ class Dect_App:
         qs = {}
         for name, q in self.q_pic.items():
             qs['q_pic_trans_{}'.format(name)] = q
-        for name, camera in self.cameras.items():
+        for name, camera in self.cameras.items():  # 多进程模式下摄像头队列与指标在子进程中, 由 camera_main 启动的 Monitor 监控
             qs['q_camera_{}'.format(name)] = camera.video_getter.waiting_queue.queue
         self.monitor = Monitor(self.exc_bucket)
         self.monitor.run(qs)
@@ -93,17 +191,27 @@ class Dect_App:
         运行总函数
         """
         self.logger.info('-'*10 + 'Dect_App Begin Running' + '-'*10)
-        self.setup_gpu_slaves()
-        self.setup_cameras()
+        t0 = time.time()
+        if self.mode == 'processing':
+            self.setup_processes()
+        else:
+            if self.setup_gpu_slaves():  # 推理模块就绪后再取流
+                self.setup_cameras()
         self.setup_monitor()
+        #分阶段启动耗时: 导入 / 配置 / 推理模块就绪(含模型载入与预热)及摄像头启动
+        self.logger.info('startup: imports {:.2f}s, config {:.2f}s, slaves+cameras {:.2f}s, total {:.2f}s.'.format(
+            IMPORT_SECONDS, t0 - T_IMPORT - IMPORT_SECONDS, time.time() - t0, time.time() - T_IMPORT))
 
         e_type, e_value, e_traceback = self.exc_bucket.get()
         self.logger.fatal("type ==> %s" % (e_type.__name__))
         self.logger.fatal("value ==> %s" %(e_value))
-        self.logger.fatal("traceback ==> file name: %s" %(e_traceback.tb_frame.f_code.co_filename))
-        self.logger.fatal("traceback ==> line no: %s" %(e_traceback.tb_lineno))
-        self.logger.fatal("traceback ==> function name: %s" %(e_traceback.tb_frame.f_code.co_name))
-        self.logger.fatal(traceback.print_exception(e_type, e_value, e_traceback))
+        if isinstance(e_traceback, str):  # 子进程传回的异常, traceback 已格式化为字符串
+            self.logger.fatal(e_traceback)
+        else:
+            self.logger.fatal("traceback ==> file name: %s" %(e_traceback.tb_frame.f_code.co_filename))
+            self.logger.fatal("traceback ==> line no: %s" %(e_traceback.tb_lineno))
+            self.logger.fatal("traceback ==> function name: %s" %(e_traceback.tb_frame.f_code.co_name))
+            self.logger.fatal(traceback.print_exception(e_type, e_value, e_traceback))
         self.logger.info('程序因故退出, 请查看日志信息.')
 
 
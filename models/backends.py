@@ -0,0 +1,111 @@
+# YOLOv5 inference backends (PyTorch / TorchScript / ONNX Runtime)
+#
+# Every backend is a callable taking a normalised BCHW tensor and returning the decoded (bs, n, nc + 5) prediction
+# tensor on the same device, so pre- and post-processing are shared. TorchScript and ONNX files must be exported with
+#   $ python models/export.py --weights ./weights/man.pt --img 640 --grid [--dynamic]
+# (--grid keeps the Detect() decode in the graph; export.py also stores class names and input shape as metadata).
+
+import json
+
+import torch
+import torch.nn as nn
+
+from models.experimental import attempt_load_cached
+
+DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16, 'int8': torch.float32}  # input dtype
+
+
+class TorchBackend:
+    # Native *.pt checkpoint loaded through attempt_load(), fused and converted model cached in cache_dir (if set)
+    def __init__(self, weights, device, precision='fp32', threads=None, cache_dir=None):
+        self.device = device
+        self.dtype = DTYPES[precision]
+        model, self.cache_hit = attempt_load_cached(weights, map_location=device, dtype=self.dtype, cache_dir=cache_dir)
+        model.eval()
+        self.names = model.module.names if hasattr(model, 'module') else model.names
+        self.stride = int(model.stride.max())
+        if precision == 'int8':  # CPU dynamic quantization, only covers nn.Linear (transformer blocks), convs stay FP32
+            if any(isinstance(m, nn.Linear) for m in model.modules()):
+                model = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+            else:
+                print(f'WARNING: int8 dynamic quantization only covers nn.Linear and {weights} has none, running FP32')
+        self.model = model
+        self.input_shape = None  # any stride-multiple shape
+
+    def prune(self, classes):
+        # Rewrite the Detect() head to output only classes (list of class indices), names follow the new indices
+        model = self.model.module if hasattr(self.model, 'module') else self.model
+        model.prune_classes(classes)
+        self.names = model.names
+
+    @torch.no_grad()  # inference only, no autograd graph whatever the caller
+    def __call__(self, img):
+        return self.model(img, augment=False)[0]
+
+
+class TorchScriptBackend:
+    # *.torchscript.pt traced by models/export.py; the Detect() grid is frozen at the traced height/width
+    def __init__(self, weights, device, precision='fp32', threads=None, cache_dir=None):
+        self.device = device
+        self.cache_hit = None  # no load-time fusion to cache
+        self.dtype = DTYPES[precision]  # int8 is not applied to traced graphs, runs FP32
+        extra_files = {'config.txt': ''}  # model metadata
+        model = torch.jit.load(weights, _extra_files=extra_files, map_location=device)
+        model.to(self.dtype).eval()
+        self.model = model
+        meta = json.loads(extra_files['config.txt'] or '{}')
+        self.names = meta.get('names')
+        self.stride = meta.get('stride', 32)
+        self.input_shape = tuple(meta['shape'][2:]) if 'shape' in meta else None
+
+    @torch.no_grad()
+    def __call__(self, img):
+        return self.model(img)[0]
+
+
+class OnnxRuntimeBackend:
+    # *.onnx exported by models/export.py, run with onnxruntime (CUDA provider if available, else CPU)
+    def __init__(self, weights, device, precision='fp32', threads=None, cache_dir=None):
+        import onnxruntime as ort  # optional dependency, only needed for this backend
+
+        self.device = device
+        self.cache_hit = None  # no load-time fusion to cache
+        providers = [('CUDAExecutionProvider', {'device_id': device.index or 0}), 'CPUExecutionProvider'] \
+            if device.type == 'cuda' else ['CPUExecutionProvider']
+        options = ort.SessionOptions()
+        if threads:  # (intra_op, inter_op), 0 = onnxruntime default
+            options.intra_op_num_threads, options.inter_op_num_threads = (int(x or 0) for x in threads)
+        self.session = ort.InferenceSession(weights, sess_options=options, providers=providers)
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.dtype = torch.float16 if inp.type == 'tensor(float16)' else torch.float32  # follow exported precision
+        b, _, h, w = inp.shape  # str dims are dynamic axes
+        self.max_batch = b if isinstance(b, int) else None
+        self.input_shape = (h, w) if isinstance(h, int) and isinstance(w, int) else None
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = json.loads(meta['names']) if 'names' in meta else None
+        self.stride = int(meta.get('stride', 32))
+
+    def __call__(self, img):
+        x = img.cpu().numpy()
+        n = self.max_batch or len(x)  # static-batch models are run in chunks
+        y = [self.session.run(None, {self.input_name: x[i:i + n]})[0] for i in range(0, len(x), n)]
+        return torch.cat([torch.from_numpy(yi) for yi in y], 0).to(self.device)
+
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'torchscript': TorchScriptBackend,
+    'onnxruntime': OnnxRuntimeBackend,
+}
+
+
+def load_backend(backend, weights, device, precision='fp32', names=None, threads=None, cache_dir=None):
+    # Returns an inference backend by name, names (list) overrides/fills class names missing from exported metadata,
+    # cache_dir holds pre-fused *.pt artifacts for fast restarts (torch backend only)
+    assert backend in BACKENDS, f'unknown backend {backend}, choose from {list(BACKENDS)}'
+    model = BACKENDS[backend](weights, device, precision, threads, cache_dir)
+    if names or model.names is None:
+        assert names, f'{weights} has no class names metadata, set NAMES in the model config'
+        model.names = list(names)
+    return model
@@ -0,0 +1,89 @@
+"""Benchmarks Detector inference backends (PyTorch / TorchScript / ONNX Runtime) on the same frames
+
+Usage:
+    $ export PYTHONPATH="$PWD" && python models/benchmark.py --weights ./weights/man.pt \
+        --torchscript ./weights/man.torchscript.pt --onnx ./weights/man.onnx --device cpu --img 640 --batch-size 1
+    # person-only Detect() head vs full head (same CLASSES filtering), boxes match unless a box's best class was pruned
+    $ python models/benchmark.py --weights ./weights/man.pt --classes person --prune
+"""
+
+import argparse
+import sys
+
+sys.path.append('./')  # to run '$ python *.py' files in subdirectories
+
+import cv2
+import numpy as np
+import torch
+
+from AIDetector_pytorch import Detector
+from utils.general import set_logging
+from utils.torch_utils import time_synchronized
+
+
+@torch.no_grad()
+def benchmark(detector, frames, batch_size=1, n=100, warmup=10):
+    # Returns mean (preprocess, inference, postprocess) ms per frame and the last detections
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    dt = np.zeros(3)
+    for k in range(warmup + n):
+        ims = batches[k % len(batches)]
+        t0 = time_synchronized()
+        img, ratio_pads = detector.preprocess_batch(ims)
+        t1 = time_synchronized()
+        pred = detector.m(img)
+        t2 = time_synchronized()
+        dets = detector.postprocess(pred, [im.shape for im in ims], ratio_pads)
+        t3 = time_synchronized()
+        if k >= warmup:
+            dt += np.array([t1 - t0, t2 - t1, t3 - t2]) / len(ims)
+    return dt / n * 1000, dets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='./weights/man.pt', help='*.pt weights path')
+    parser.add_argument('--torchscript', type=str, default='', help='*.torchscript.pt path (exported with --grid)')
+    parser.add_argument('--onnx', type=str, default='', help='*.onnx path (exported with --grid)')
+    parser.add_argument('--source', type=str, default='', help='image file, random frames if empty')
+    parser.add_argument('--img-size', type=int, default=640, help='inference size (pixels)')
+    parser.add_argument('--frame-size', nargs=2, type=int, default=[1080, 1920], help='random frame height, width')
+    parser.add_argument('--batch-size', type=int, default=1, help='frames per forward pass')
+    parser.add_argument('--n', type=int, default=100, help='timed iterations')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or cpu')
+    parser.add_argument('--precision', default='auto', help='auto, fp32, fp16, bf16 or int8')
+    parser.add_argument('--classes', nargs='+', type=str, help='detect only these class names (CLASSES)')
+    parser.add_argument('--prune', action='store_true', help='also run the torch backend with the pruned head')
+    opt = parser.parse_args()
+    print(opt)
+    set_logging()
+
+    if opt.source:
+        frames = [cv2.imread(opt.source)] * opt.batch_size
+    else:
+        frames = [np.random.randint(0, 255, (*opt.frame_size, 3), dtype=np.uint8) for _ in range(opt.batch_size)]
+
+    runs = [('torch', 'torch', opt.weights, False), ('torchscript', 'torchscript', opt.torchscript, False),
+            ('onnxruntime', 'onnxruntime', opt.onnx, False), ('torch-pruned', 'torch', opt.weights, opt.prune)]
+    results, reference = [], None
+    for name, backend, weights, prune in runs:
+        if not weights or (name == 'torch-pruned' and not prune):
+            continue
+        try:
+            detector = Detector({'WEIGHTS': weights, 'DEVICE': opt.device, 'BACKEND': backend,
+                                 'PRECISION': opt.precision, 'CLASSES': opt.classes, 'PRUNE_HEAD': prune},
+                                img_size=opt.img_size)
+            dt, dets = benchmark(detector, frames, opt.batch_size, opt.n)
+        except Exception as e:
+            print(f'{name} benchmark failure: {e}')
+            continue
+        reference = dets[0] if reference is None else reference
+        if prune:  # identical unless a box's best class is one of the pruned classes (the pruned head cannot see it)
+            match = np.array_equal(dets[0], reference)
+        else:
+            match = len(dets[0]) == len(reference)
+        results.append((name, *dt, 1000 / dt.sum(), len(dets[0]), match))
+
+    print('\n%14s%12s%12s%12s%10s%8s%8s' % ('backend', 'pre(ms)', 'infer(ms)', 'post(ms)', 'FPS', 'boxes', 'match'))
+    for r in results:
+        print('%14s%12.2f%12.2f%12.2f%10.1f%8g%8s' % r)
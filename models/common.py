@@ -5,18 +5,16 @@ from copy import copy
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
-import requests
 import torch
 import torch.nn as nn
-from PIL import Image
 from torch.cuda import amp
 
-from utils.datasets import letterbox
 from utils.general import non_max_suppression, make_divisible, scale_coords, increment_path, xyxy2xywh
-from utils.plots import color_list, plot_one_box
 from utils.torch_utils import time_synchronized
 
+# pandas, requests, PIL and utils.plots (matplotlib/seaborn) are only needed by autoShape/Detections,
+# they are imported where used to keep detector startup fast
+
 
 def autopad(k, p=None):  # kernel, padding
     # Pad to 'same'
@@ -247,6 +245,9 @@ class autoShape(nn.Module):
         #   numpy:           = np.zeros((640,1280,3))  # HWC
         #   torch:           = torch.zeros(16,3,320,640)  # BCHW (scaled to size=640, 0-1 values)
         #   multiple:        = [Image.open('image1.jpg'), Image.open('image2.jpg'), ...]  # list of images
+        import requests
+        from PIL import Image
+        from utils.datasets import letterbox
 
         t = [time_synchronized()]
         p = next(self.model.parameters())  # for device and type
@@ -312,6 +313,9 @@ class Detections:
         self.s = shape  # inference BCHW shape
 
     def display(self, pprint=False, show=False, save=False, render=False, save_dir=''):
+        from PIL import Image
+        from utils.plots import color_list, plot_one_box
+
         colors = color_list()
         for i, (img, pred) in enumerate(zip(self.imgs, self.pred)):
             str = f'image {i + 1}/{len(self.pred)}: {img.shape[0]}x{img.shape[1]} '
@@ -353,6 +357,9 @@ class Detections:
 
     def pandas(self):
         # return detections as pandas DataFrames, i.e. print(results.pandas().xyxy[0])
+        import pandas as pd
+        pd.options.display.max_columns = 10
+
         new = copy(self)  # return copy
         ca = 'xmin', 'ymin', 'xmax', 'ymax', 'confidence', 'class', 'name'  # xyxy columns
         cb = 'xcenter', 'ycenter', 'width', 'height', 'confidence', 'class', 'name'  # xywh columns
@@ -1,5 +1,10 @@
 # YOLOv5 experimental modules
 
+import hashlib
+import logging
+import os
+from pathlib import Path
+
 import numpy as np
 import torch
 import torch.nn as nn
@@ -7,6 +12,8 @@ import torch.nn as nn
 from models.common import Conv, DWConv
 from utils.google_utils import attempt_download
 
+logger = logging.getLogger(__name__)
+
 
 class CrossConv(nn.Module):
     # Cross Convolution Downsample
@@ -132,3 +139,37 @@ def attempt_load(weights, map_location=None):
         for k in ['names', 'stride']:
             setattr(model, k, getattr(model[-1], k))
         return model  # return ensemble
+
+
+def file_hash(file, chunk=1 << 20):
+    # Returns the sha1 hex digest of a file
+    h = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for b in iter(lambda: f.read(chunk), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+def attempt_load_cached(weights, map_location=None, dtype=torch.float32, cache_dir='weights/.cache'):
+    # Loads a single fused model converted to dtype from cache_dir, keyed by weights hash so edited weights rebuild.
+    # On a miss the model is loaded with attempt_load() and the fused artifact saved.
+    # Returns model, cache hit (bool, None if caching is disabled)
+    if not cache_dir or isinstance(weights, list):
+        return attempt_load(weights, map_location=map_location).to(dtype), None
+    attempt_download(weights)
+    f = Path(cache_dir) / f'{Path(weights).stem}-{file_hash(weights)[:16]}-{str(dtype).split(".")[-1]}.pt'
+    if f.exists():
+        try:
+            return torch.load(f, map_location=map_location, weights_only=False), True  # trusted local artifact, full pickle
+        except Exception as e:
+            logger.warning(f'WARNING: cached model {f} unreadable ({e}), rebuilding')
+
+    model = attempt_load(weights, map_location='cpu').to(dtype)  # save on CPU, map to device on load
+    try:
+        f.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f.with_suffix(f'.{os.getpid()}.tmp')  # atomic write, concurrent workers may build the same artifact
+        torch.save(model, tmp)
+        os.replace(tmp, f)
+    except OSError as e:
+        logger.warning(f'WARNING: cannot write cached model {f} ({e})')
+    return (model.to(map_location) if map_location else model), False
@@ -5,6 +5,7 @@ Usage:
 """
 
 import argparse
+import json
 import sys
 import time
 
@@ -27,6 +28,7 @@ if __name__ == '__main__':
     parser.add_argument('--dynamic', action='store_true', help='dynamic ONNX axes')
     parser.add_argument('--grid', action='store_true', help='export Detect() layer grid')
     parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+    parser.add_argument('--classes', nargs='+', type=str, help='keep only these class names in the Detect() head')
     opt = parser.parse_args()
     opt.img_size *= 2 if len(opt.img_size) == 1 else 1  # expand
     print(opt)
@@ -36,6 +38,8 @@ if __name__ == '__main__':
     # Load PyTorch model
     device = select_device(opt.device)
     model = attempt_load(opt.weights, map_location=device)  # load FP32 model
+    if opt.classes:
+        model.prune_classes([model.names.index(c) for c in opt.classes])  # person-only head etc.
     labels = model.names
 
     # Checks
@@ -57,13 +61,14 @@ if __name__ == '__main__':
         #     m.forward = m.forward_export  # assign forward (optional)
     model.model[-1].export = not opt.grid  # set Detect() layer grid export
     y = model(img)  # dry run
+    meta = {'names': labels, 'stride': gs, 'shape': list(img.shape)}  # read back by models/backends.py
 
     # TorchScript export
     try:
         print('\nStarting TorchScript export with torch %s...' % torch.__version__)
         f = opt.weights.replace('.pt', '.torchscript.pt')  # filename
         ts = torch.jit.trace(model, img)
-        ts.save(f)
+        ts.save(f, _extra_files={'config.txt': json.dumps(meta)})
         print('TorchScript export success, saved as %s' % f)
     except Exception as e:
         print('TorchScript export failure: %s' % e)
@@ -82,6 +87,11 @@ if __name__ == '__main__':
         # Checks
         onnx_model = onnx.load(f)  # load onnx model
         onnx.checker.check_model(onnx_model)  # check onnx model
+
+        # Metadata
+        for k, v in meta.items():
+            onnx_model.metadata_props.add(key=k, value=json.dumps(v) if k == 'names' else str(v))
+        onnx.save(onnx_model, f)
         # print(onnx.helper.printable_graph(onnx_model.graph))  # print a human readable model
         print('ONNX export success, saved as %s' % f)
     except Exception as e:
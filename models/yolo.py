@@ -3,6 +3,7 @@
 import argparse
 import logging
 import sys
+from collections import OrderedDict
 from copy import deepcopy
 
 sys.path.append('./')  # to run '$ python *.py' files in subdirectories
@@ -10,7 +11,6 @@ logger = logging.getLogger(__name__)
 
 from models.common import *
 from models.experimental import *
-from utils.autoanchor import check_anchor_order
 from utils.general import make_divisible, check_file, set_logging
 from utils.torch_utils import time_synchronized, fuse_conv_and_bn, model_info, scale_img, initialize_weights, \
     select_device, copy_attr
@@ -24,6 +24,7 @@ except ImportError:
 class Detect(nn.Module):
     stride = None  # strides computed during build
     export = False  # onnx export
+    cache_size = 32  # max cached decode grids and output buffers (LRU)
 
     def __init__(self, nc=80, anchors=(), ch=()):  # detection layer
         super(Detect, self).__init__()
@@ -41,6 +42,8 @@ class Detect(nn.Module):
         # x = x.copy()  # for profiling
         z = []  # inference output
         self.training |= self.export
+        if not (self.training or torch.jit.is_tracing() or torch.onnx.is_in_onnx_export()):  # exports keep plain decode
+            return self.forward_cached(x)
         for i in range(self.nl):
             x[i] = self.m[i](x[i])  # conv
             bs, _, ny, nx = x[i].shape  # x(bs,255,20,20) to x(bs,3,20,20,85)
@@ -57,6 +60,72 @@ class Detect(nn.Module):
 
         return x if self.training else (torch.cat(z, 1), x)
 
+    def forward_cached(self, x):
+        # Inference decode in place into a reused output buffer, grids cached per (level, shape, device, dtype).
+        # The returned tensor is overwritten by the next forward at the same input shape
+        shapes = []
+        for i in range(self.nl):
+            x[i] = self.m[i](x[i])  # conv
+            bs, _, ny, nx = x[i].shape
+            x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2)  # x(bs,3,20,20,85) view, no copy
+            shapes.append((ny, nx))
+            if self.grid[i].shape[2:4] != (ny, nx):  # keep self.grid in step for the plain path (export traces)
+                self.grid[i] = self._make_grid(nx, ny).to(x[i].device)
+        device, dtype = x[0].device, x[0].dtype
+        n = sum(self.na * ny * nx for ny, nx in shapes)
+        key = ('out', tuple(shapes), device, dtype)
+        z = self._lru(key, lambda: torch.empty(0, n, self.no, device=device, dtype=dtype))
+        if z.shape[0] < bs:  # grow to the largest batch seen at this shape
+            z = self._lru(key, lambda: torch.empty(bs, n, self.no, device=device, dtype=dtype), replace=True)
+        z = z[:bs]
+
+        k = 0
+        for i, (ny, nx) in enumerate(shapes):
+            gxy, awh = self._lru((i, ny, nx, device, dtype), lambda: self._decode_grid(i, nx, ny, device, dtype))
+            y = z[:, k:k + self.na * ny * nx].view(bs, self.na, ny, nx, self.no)
+            y.copy_(x[i]).sigmoid_()  # permute into the buffer, then contiguous in-place sigmoid
+            y[..., 0:2].mul_(2 * float(self.stride[i])).add_(gxy)  # xy = (sig * 2 - 0.5 + grid) * stride
+            y[..., 2:4].pow_(2).mul_(awh)  # wh = (sig * 2) ** 2 * anchor
+            k += self.na * ny * nx
+        return z, x
+
+    def __getstate__(self):  # caches are not saved with the model
+        state = self.__dict__.copy()
+        state.pop('decode_cache', None)
+        return state
+
+    def _decode_grid(self, i, nx, ny, device, dtype):
+        # Returns the xy offset (grid - 0.5) * stride and wh gain 4 * anchor of level i
+        gxy = (self._make_grid(nx, ny).to(device) - 0.5) * float(self.stride[i])
+        return gxy.to(dtype), (self.anchor_grid[i] * 4).to(device, dtype)
+
+    def _lru(self, key, build, replace=False):
+        # Returns cache[key], built with build() on a miss, least recently used entries evicted beyond cache_size
+        if not hasattr(self, 'decode_cache'):  # modules unpickled from older checkpoints
+            self.decode_cache = OrderedDict()
+        cache = self.decode_cache
+        if key in cache and not replace:
+            cache.move_to_end(key)
+        else:
+            cache.pop(key, None)
+            cache[key] = build()
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return cache[key]
+
+    def prune(self, classes):
+        # Keep only the output channels of classes (list of class indices), new class i is old class classes[i]
+        keep = torch.tensor([a * self.no + c for a in range(self.na) for c in [0, 1, 2, 3, 4] + [5 + k for k in classes]])
+        for i, conv in enumerate(self.m):
+            m = nn.Conv2d(conv.in_channels, len(keep), 1).to(conv.weight.device, conv.weight.dtype)
+            m.weight.data = conv.weight.data[keep].clone()
+            m.bias.data = conv.bias.data[keep].clone()
+            self.m[i] = m
+        self.nc = len(classes)
+        self.no = self.nc + 5
+        self.decode_cache = OrderedDict()  # output buffers were sized for the old head
+        return self
+
     @staticmethod
     def _make_grid(nx=20, ny=20):
         yv, xv = torch.meshgrid([torch.arange(ny), torch.arange(nx)])
@@ -92,6 +161,7 @@ class Model(nn.Module):
             s = 256  # 2x min stride
             m.stride = torch.tensor([s / x.shape[-2] for x in self.forward(torch.zeros(1, ch, s, s))])  # forward
             m.anchors /= m.stride.view(-1, 1, 1)
+            from utils.autoanchor import check_anchor_order
             check_anchor_order(m)
             self.stride = m.stride
             self._initialize_biases()  # only run once
@@ -174,6 +244,13 @@ class Model(nn.Module):
         self.info()
         return self
 
+    def prune_classes(self, classes):  # keep only classes (list of class indices) in the Detect() head
+        print(f'Pruning Detect() head to {len(classes)}/{self.model[-1].nc} classes... ')
+        self.model[-1].prune(classes)
+        self.names = [self.names[c] for c in classes]
+        self.yaml['nc'] = len(classes)
+        return self
+
     def nms(self, mode=True):  # add or remove NMS module
         present = type(self.model[-1]) is NMS  # last layer is NMS
         if mode and not present:
@@ -8,7 +8,15 @@ Time: 2023/8/4
 """
 import cv2
 import logging
+import queue
 import threading
+import time
+from tools import detections
+from tools.deadline import LatencyBudget
+from tools.metadata_sink import MetadataSink
+from tools.result_join import ResultJoin
+from tools.roi import Roi
+from tools.stream_encoder import StreamEncoder
 from tools.video_getter import VideoGetter
 from tools.waiting_queue import WaitingQueue
 from tools.yolov5_draw import draw_bboxes
@@ -16,7 +24,6 @@ import sys
 import datetime
 import pytz
 import numpy as np
-import subprocess as sp
 
 
 def letterbox(img, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
@@ -57,7 +64,8 @@ class Camera:
     摄像头模块类
     """
     def __init__(self, name: str, fps: int, cfg_camera: dict,
-            q_pic: dict, exc_bucket):
+            q_pic: dict, exc_bucket, ring_slots: int = 32, max_reorder_ms: float = None,
+            latency_budget_ms: float = None):
         """
         初始化函数
         Args: 
@@ -65,6 +73,9 @@ class Camera:
             fps: 每秒抽取帧数
             cfg_camera: 摄像头配置信息
             q_pic: 待推理图片队列
+            ring_slots: 帧环槽位数
+            max_reorder_ms: 推理结果最大重排等待毫秒数, None 为一直等待
+            latency_budget_ms: 帧时延预算毫秒数, 超出预算的帧在入队/推理/推流各级被丢弃
         """
         self.name = name
         self.fps = fps
@@ -72,74 +83,124 @@ class Camera:
         self.q_pic = q_pic
         self.exc_bucket = exc_bucket
         self.model_types = self.cfg_camera["MODEL_TYPES"]
-        self.rturl = self.cfg_camera["RTMP/RTSP"]
+        #输出方式: video 绘制后编码推流; metadata 只发布检测元数据, 不绘制不编码; both 两者都输出
+        self.output = self.cfg_camera.get("OUTPUT", "video")
+        assert self.output in ("video", "metadata", "both"), '未知输出方式 {}'.format(self.output)
+        self.rturl = self.cfg_camera.get("RTMP/RTSP")
         self.pred_waiting_queue = {}
+        self.last_predict = {}  # 各模型最近一次推流的检测结果, 静止帧沿用
+        self.max_reorder = max_reorder_ms / 1000 if max_reorder_ms else None
+        self.budget = LatencyBudget(latency_budget_ms)
         self.output_size = self.cfg_camera["OUTPUT_SIZE"]
+        self.roi = Roi(self.cfg_camera["ROI"]) if self.cfg_camera.get("ROI") else None  # 检测区域, 随帧传给推理模块
+        #推流编码: 独立线程写 ffmpeg, 推流阻塞不影响结果消费
+        self.encoder = StreamEncoder(name, self.rturl, self.output_size, self.cfg_camera.get("OUTPUT_FPS"), exc_bucket) \
+            if self.output in ("video", "both") else None
+        #检测元数据: 按抽帧时间戳发布到本地 socket 或文件
+        cfg_metadata = self.cfg_camera.get("METADATA", {})
+        self.metadata = MetadataSink(name, cfg_metadata["TARGET"], cfg_metadata.get("FORMAT", "json")) \
+            if self.output in ("metadata", "both") else None
 
         self.logger = logging.getLogger('log')
 
-        self.video_getter = VideoGetter(self.fps, cfg_camera, name, self.exc_bucket)
+        self.video_getter = VideoGetter(self.fps, cfg_camera, name, self.exc_bucket, ring_slots=ring_slots)
+
+    def setup_waiting_queues(self):
+        """
+        创建各模型的推理结果等待队列, 按序汇入同一个汇合队列按帧拼合; 被跳过或汇合后迟到的结果释放其帧引用
+        """
+        release = lambda item: item[0].release()
+        models = [model for model in self.model_types if model in self.q_pic.keys()]
+        self.result_join = ResultJoin('camera.{}'.format(self.name), models, timeout=self.max_reorder, on_drop=release)
+        for model in models:
+            self.pred_waiting_queue[model] = WaitingQueue(
+                maxsize=50, name='camera.{}.{}'.format(self.name, model),
+                max_latency=self.max_reorder, on_drop=release, out_queue=self.result_join.queue, tag=model)
+            self.result_join.add_source(self.pred_waiting_queue[model])
+        self.queue_ok_flag = True
+
+    def put_latest(self, q: queue.Queue, item: tuple):
+        """
+        放入待推理队列, 队列满时丢弃队首最旧的帧. 非阻塞实现, 多个摄像头线程同时操作也不会卡住
+        """
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    waiting_queue, timestamp, ref, _, _ = q.get_nowait()
+                except queue.Empty:  # 已被 slave 取走
+                    continue
+                self.budget.drop(waiting_queue, timestamp, 'evicted')
+                ref.release()
+
+    def reuse_predict(self, model: str, timestamp: float, ref):
+        """
+        静止帧不推理, 沿用该模型上次的检测结果直接送入等待队列
+        """
+        waiting_queue = self.pred_waiting_queue[model]
+        waiting_queue.putstamp(timestamp)
+        waiting_queue.putitem(timestamp, (ref.retain(), self.last_predict.get(model, detections.empty())))
 
     def send_frame(self):
         """
-        发送待推理图片
+        发送待推理图片. 同一帧引用分发给各模型队列, 每个队列项持有一个引用
         """
         try:
-            for model in self.model_types:
-                self.pred_waiting_queue[model] = WaitingQueue(maxsize=50)
-            self.queue_ok_flag = True
+            self.setup_waiting_queues()
             while True:
-                timestamp, imgarr = self.video_getter.get()
+                timestamp, ref, infer = self.video_getter.get()
                 for model in self.model_types:
                     if model in self.q_pic.keys():
-                        self.pred_waiting_queue[model].putstamp(timestamp)
-
-                        if not self.q_pic[model].full():
-                            self.q_pic[model].put((self.pred_waiting_queue[model], timestamp, imgarr))
-                        else:
-                            self.q_pic[model].get()
-                            self.q_pic[model].put((self.pred_waiting_queue[model], timestamp, imgarr))
+                        if not infer:
+                            self.reuse_predict(model, timestamp, ref)
+                            continue
+                        waiting_queue = self.pred_waiting_queue[model]
+                        waiting_queue.putstamp(timestamp)
+                        if self.budget.expired(timestamp):  # 抽帧后积压过久
+                            self.budget.drop(waiting_queue, timestamp, 'camera')
+                            continue
+                        self.put_latest(self.q_pic[model], (waiting_queue, timestamp, ref.retain(), self.roi, time.time()))
+                ref.release()
             
         except Exception:
             self.exc_bucket.put(sys.exc_info())
 
     def get_frame(self):
         """
-        将预测完成的图片推流
+        按帧取出各模型汇合后的预测结果, 绘制一次后交给推流编码器
         """
-        if "rtsp" in self.rturl:
-            f_type = "rtsp"
-        else:
-            f_type = "flv"
-        
-        #ffmpeg运行参数
-        command = ['ffmpeg',
-                '-y',
-                '-f', 'rawvideo',
-                '-vcodec','rawvideo',
-                '-pix_fmt', 'bgr24',
-                '-s', "{}x{}".format(self.output_size, self.output_size),
-                '-r', str(15),
-                '-i', '-',
-                '-c:v', 'libx264',
-                '-pix_fmt', 'yuv420p',
-                '-preset', 'ultrafast',
-                '-f', f_type, 
-                self.rturl]
-        
-        p = sp.Popen(command, stdin=sp.PIPE)
-
         while True:
             try:
-                for model in self.model_types:
-                    # 在这里获取帧数据 frame
-                    timestamp, (imgarr, predict) = self.pred_waiting_queue[model].get_with_stamp()
-                    cur_time = int(round(datetime.datetime.timestamp(datetime.datetime.now(pytz.timezone('PRC')))*1000))
-
-                    if model == "man":
-                        frame = draw_bboxes(imgarr, predict)
-                        frame = cv2.resize(frame, (self.output_size, self.output_size), interpolation=cv2.INTER_LINEAR)
-                        p.stdin.write(frame.tostring())
+                # 在这里获取帧数据 frame, parts: k=模型名, v=(帧引用, 检测结果), 各模型的帧引用指向同一帧
+                timestamp, parts = self.result_join.get()
+                cur_time = int(round(datetime.datetime.timestamp(datetime.datetime.now(pytz.timezone('PRC')))*1000))
+
+                try:
+                    for model, (_, predict) in parts.items():
+                        self.last_predict[model] = predict
+                    if self.budget.expired(timestamp):  # 超出预算, 不再推流
+                        for model in parts:
+                            self.budget.count(self.pred_waiting_queue[model].name, 'stream')
+                        continue
+                    image = next(iter(parts.values()))[0].frame
+                    if self.metadata is not None:
+                        for model, (_, predict) in parts.items():
+                            self.metadata.publish(model, timestamp, image.shape, predict)
+                    if self.encoder is not None:
+                        # 先缩放到编码器的帧缓冲再绘制, 帧环中的原帧只读; 无空闲缓冲或超出帧率上限时跳过
+                        frame = self.encoder.acquire(image.shape)
+                        if frame is not None:
+                            h, w = image.shape[:2]
+                            oh, ow = frame.shape[:2]
+                            cv2.resize(image, (ow, oh), dst=frame, interpolation=cv2.INTER_LINEAR)
+                            predict = np.concatenate([predict for _, predict in parts.values()])
+                            draw_bboxes(frame, predict, scale=(ow / w, oh / h))
+                            self.encoder.put(frame)
+                finally:
+                    for ref, _ in parts.values():
+                        ref.release()
 
             except Exception as e:
                 print("Error:", e)      
@@ -160,6 +221,10 @@ class Camera:
             self.thread.start()
             self.logger.info('camera {} sender 线程启动.'.format(self.name))
 
+            if self.encoder is not None:
+                self.encoder.run()
+                self.logger.info('camera {} encoder 线程启动.'.format(self.name))
+
 
 
 
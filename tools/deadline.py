@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: deadline.py
+Desc: 端到端时延预算: 各级(入队/推理出队/推流)丢弃超出预算的旧帧
+Author: gaoy
+Time: 2026/10/17
+"""
+import time
+from tools import metrics
+
+
+class LatencyBudget:
+    """帧时延预算. 帧的年龄以其时间戳(抽帧时刻)计.
+
+    丢帧按 <队列名>.expired.<阶段> 计数, 队列名即等待队列名 camera.<摄像头>.<模型>.
+
+    Args:
+        budget_ms (float): 预算毫秒数, 空或0为不限.
+    """
+    def __init__(self, budget_ms: float = None):
+        self.budget = budget_ms / 1000 if budget_ms else None
+
+    def expired(self, timestamp: float, now: float = None) -> bool:
+        """时间戳为 timestamp 的帧是否已超出预算."""
+        if self.budget is None:
+            return False
+        return (now or time.time()) - timestamp > self.budget
+
+    def count(self, qname: str, stage: str, n: int = 1):
+        """记录 qname 在 stage 阶段丢弃的帧数."""
+        metrics.counter('{}.expired.{}'.format(qname, stage)).inc(n)
+
+    def drop(self, waiting_queue, timestamp: float, stage: str):
+        """从等待队列删除被丢弃帧的时间戳并计数."""
+        waiting_queue.removestamp(timestamp)
+        self.count(waiting_queue.name, stage)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: detection_cache.py
+Desc: 近重复帧检测结果缓存: 按缩小后的差值感知哈希(dHash)查找, 静止画面/卡住的流直接返回缓存结果, 不再推理
+Author: gaoy
+Time: 2026/10/17
+"""
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from tools import metrics
+
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(1)  # 每个字节的置位数
+
+
+class DetectionCache:
+    """近重复帧的检测结果 LRU 缓存.
+
+    帧缩小为 (hash_size+1) x hash_size 的灰度图, 相邻像素比较得到 hash_size^2 位的 dHash.
+    同一分组(帧尺寸/推理尺寸/ROI 等, 由调用方给出)内与某条缓存的汉明距离不超过 max_distance 即视为近重复帧,
+    返回该条的检测结果. 哈希很粗, 远处小目标的移动可能不改变哈希, 此类场景应调小 max_distance 或增大 hash_size.
+    单线程使用(每个检测器一个).
+
+    Args:
+        name (str): 指标名前缀, 计数器为 <name>.dedup.<hits/misses/evictions>.
+        maxsize (int): 最大条目数.
+        hash_size (int): 哈希边长, 位数为其平方.
+        max_distance (int): 视为近重复的最大汉明距离(位).
+    """
+    def __init__(self, name: str, maxsize: int = 16, hash_size: int = 16, max_distance: int = 2):
+        self.maxsize = maxsize
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.items = OrderedDict()  # k=序号, v=(分组, 哈希, 检测结果)
+        self.seq = 0
+        self.small = np.empty((hash_size, hash_size + 1, 3), dtype=np.uint8)
+        self.gray = np.empty((hash_size, hash_size + 1), dtype=np.uint8)
+
+        self.hits = metrics.counter('{}.dedup.hits'.format(name))
+        self.misses = metrics.counter('{}.dedup.misses'.format(name))
+        self.evictions = metrics.counter('{}.dedup.evictions'.format(name))
+
+    def phash(self, frame: np.ndarray) -> np.ndarray:
+        """帧的 dHash, 按位打包为 uint8 数组."""
+        cv2.resize(frame, (self.hash_size + 1, self.hash_size), dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        return np.packbits(self.gray[:, 1:] > self.gray[:, :-1])
+
+    def lookup(self, frame: np.ndarray, group) -> tuple:
+        """查找近重复帧的检测结果.
+
+        Args:
+            frame (np.ndarray): 推理输入(BGR).
+            group: 分组键, 只在同组内比较.
+        Returns:
+            phash: 帧哈希, 未命中时推理后连同结果传给 store().
+            dets: 命中时为缓存的检测结果, 否则为 None.
+        """
+        phash = self.phash(frame)
+        best, best_distance = None, self.max_distance + 1
+        for seq, (g, h, _) in self.items.items():
+            if g == group:
+                distance = int(POPCOUNT[phash ^ h].sum())
+                if distance < best_distance:
+                    best, best_distance = seq, distance
+        if best is None:
+            self.misses.inc()
+            return phash, None
+        self.hits.inc()
+        self.items.move_to_end(best)
+        return phash, self.items[best][2]
+
+    def store(self, phash: np.ndarray, group, dets: np.ndarray):
+        """缓存一帧的检测结果, 超出容量时淘汰最久未用的条目."""
+        self.items[self.seq] = (group, phash, dets)
+        self.seq += 1
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+            self.evictions.inc()
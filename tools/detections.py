@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: detections.py
+Desc: 检测结果结构(numpy 结构化数组)
+Author: gaoy
+Time: 2026/10/17
+"""
+import numpy as np
+
+# 每个检测框一行, 字段顺序与原 (x1, y1, x2, y2, lbl, conf) 元组一致, 可直接解包
+DET_DTYPE = np.dtype([
+    ('x1', np.int32), ('y1', np.int32), ('x2', np.int32), ('y2', np.int32),
+    ('lbl', 'U16'), ('conf', np.float32),
+])
+
+# 元数据输出的紧凑二进制记录(小端, 每框 28 字节), 坐标截断到 int16 范围
+WIRE_DTYPE = np.dtype([
+    ('x1', '<i2'), ('y1', '<i2'), ('x2', '<i2'), ('y2', '<i2'),
+    ('lbl', 'S16'), ('conf', '<f4'),
+])
+
+
+def empty() -> np.ndarray:
+    """返回空检测结果."""
+    return np.zeros(0, dtype=DET_DTYPE)
+
+
+def from_array(det: np.ndarray, names: np.ndarray) -> np.ndarray:
+    """由 (n, 6) [xyxy, conf, cls] 数组构造检测结果.
+
+    Args:
+        det (np.ndarray): 已还原到原图坐标的检测框.
+        names (np.ndarray): 类别名数组, 下标为类别 id.
+    """
+    dets = np.empty(len(det), dtype=DET_DTYPE)
+    dets['x1'], dets['y1'], dets['x2'], dets['y2'] = det[:, :4].T
+    dets['conf'] = det[:, 4]
+    dets['lbl'] = names[det[:, 5].astype(np.int64)]
+    return dets
+
+
+def select(dets: np.ndarray, lbl: str) -> np.ndarray:
+    """按标签筛选检测结果, 如 select(dets, 'person')."""
+    return dets[dets['lbl'] == lbl]
+
+
+def merge(dets: np.ndarray, thres: float = 0.6) -> np.ndarray:
+    """合并重叠框(切块推理的跨块 NMS), 按置信度从高到低保留.
+
+    用交集占较小框面积的比例(IoS)判定重叠, 块边缘被截断的半个目标框也会被同一目标的完整框抑制.
+
+    Args:
+        dets (np.ndarray): 检测结果.
+        thres (float): IoS 阈值, 超过则视为同一目标.
+    """
+    if len(dets) < 2:
+        return dets
+    dets = dets[np.argsort(-dets['conf'], kind='stable')]
+    x1, y1, x2, y2 = (dets[k].astype(np.float32) for k in ('x1', 'y1', 'x2', 'y2'))
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    same = dets['lbl'][:, None] == dets['lbl'][None, :]
+    keep = np.ones(len(dets), dtype=bool)
+    for i in range(len(dets)):
+        if not keep[i]:
+            continue
+        w = (np.minimum(x2[i], x2[i + 1:]) - np.maximum(x1[i], x1[i + 1:])).clip(0)
+        h = (np.minimum(y2[i], y2[i + 1:]) - np.maximum(y1[i], y1[i + 1:])).clip(0)
+        ios = w * h / np.maximum(np.minimum(areas[i], areas[i + 1:]), 1e-6)
+        keep[i + 1:] &= ~((ios > thres) & same[i, i + 1:])
+    return dets[keep]
+
+
+def to_list(dets: np.ndarray) -> list:
+    """转为 [[x1, y1, x2, y2, lbl, conf], ...], 用于 JSON 输出."""
+    return [[x1, y1, x2, y2, lbl, round(conf, 4)] for x1, y1, x2, y2, lbl, conf in dets.tolist()]
+
+
+def to_bytes(dets: np.ndarray) -> bytes:
+    """转为紧凑二进制记录(WIRE_DTYPE)."""
+    wire = np.empty(len(dets), dtype=WIRE_DTYPE)
+    for k in ('x1', 'y1', 'x2', 'y2'):
+        wire[k] = dets[k].clip(-32768, 32767)
+    wire['lbl'] = np.char.encode(dets['lbl'], 'utf-8')
+    wire['conf'] = dets['conf']
+    return wire.tobytes()
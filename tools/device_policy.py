@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: device_policy.py
+Desc: 设备/精度/线程策略
+Author: gaoy
+Time: 2026/10/17
+"""
+import logging
+import os
+import torch
+
+logger = logging.getLogger('log')
+
+PRECISIONS = ('auto', 'fp32', 'fp16', 'bf16', 'int8')
+
+
+def resolve_device(device: str) -> torch.device:
+    """将配置中的 DEVICE 解析为 torch.device.
+
+    不修改 CUDA_VISIBLE_DEVICES(进程级全局变量), 多个 slave 线程各自绑定显卡互不干扰.
+
+    Args:
+        device (str): 'cpu' / '0' / '1' / 'cuda:1'.
+    """
+    device = str(device).strip().lower()
+    if device in ('', 'cpu') or not torch.cuda.is_available():
+        if device not in ('', 'cpu'):
+            logger.warning('CUDA 不可用, 设备 {} 回退到 cpu.'.format(device))
+        return torch.device('cpu')
+    index = int(device.replace('cuda:', '').split(',')[0])
+    assert index < torch.cuda.device_count(), '显卡 {} 不存在'.format(device)
+    return torch.device('cuda', index)
+
+
+def resolve_precision(precision: str, device: torch.device) -> str:
+    """按设备选择推理精度: GPU 默认 fp16, CPU 默认 fp32; CPU 不支持 fp16, GPU 不做 int8.
+
+    Args:
+        precision (str): auto/fp32/fp16/bf16/int8.
+        device (torch.device): 推理设备.
+    """
+    precision = (precision or 'auto').lower()
+    assert precision in PRECISIONS, '未知精度 {}, 可选 {}'.format(precision, PRECISIONS)
+    if precision == 'auto':
+        return 'fp16' if device.type == 'cuda' else 'fp32'
+    if device.type == 'cpu' and precision == 'fp16':
+        logger.warning('cpu 上 fp16 推理很慢或不受支持, 改用 fp32.')
+        return 'fp32'
+    if device.type == 'cuda' and precision == 'int8':
+        logger.warning('gpu 上不做动态 int8 量化, 改用 fp16.')
+        return 'fp16'
+    if device.type == 'cuda' and precision == 'bf16' and not torch.cuda.is_bf16_supported():
+        logger.warning('显卡不支持 bf16, 改用 fp16.')
+        return 'fp16'
+    return precision
+
+
+def default_threads(n_slaves: int) -> int:
+    """多个 cpu slave 平分物理核, 防止超额订阅."""
+    return max(1, (os.cpu_count() or 1) // max(1, n_slaves))
+
+
+def apply_threads(intra_op: int = None, inter_op: int = None):
+    """设置本进程的 intra-op 与 inter-op 线程数.
+
+    两者均为进程级设置, 同进程内后设置的覆盖先前的: threading 模式下所有 slave 共用一份, 由主程序统一设置一次;
+    processing 模式下每个推理进程各自设置. inter-op 线程池只能在首次并行计算前设置, 之后的设置会被忽略.
+    """
+    if intra_op:
+        torch.set_num_threads(int(intra_op))
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(int(inter_op))
+        except RuntimeError:
+            logger.warning('inter-op 线程数已被设置为 {}, 忽略新的设置 {}.'.format(
+                torch.get_num_interop_threads(), inter_op))
+
+
+def bind_device(device: torch.device):
+    """将当前线程绑定到推理显卡(CUDA 当前设备为线程级状态)."""
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: frame_ring.py
+Desc: 预分配的引用计数帧环(threading 模式下摄像头帧的零拷贝传递)
+Author: gaoy
+Time: 2026/10/17
+"""
+from collections import deque
+from threading import Lock
+import numpy as np
+
+
+class FrameRef:
+    """帧环槽位的引用. 每个持有者用完后调用一次 release(), 计数归零时槽位回收复用.
+
+    frame 为只读视图, 下游不能在其上绘制或修改.
+    每个槽位的 FrameRef 对象预先创建并重复使用, 释放后不应再访问.
+
+    Args:
+        ring (FrameRing): 所属帧环.
+        slot (int): 槽位号.
+    """
+    __slots__ = ('ring', 'slot', 'frame')
+
+    def __init__(self, ring, slot: int):
+        self.ring = ring
+        self.slot = slot
+        self.frame = ring.buffers[slot].view()
+        self.frame.flags.writeable = False
+
+    def retain(self, n: int = 1):
+        """增加 n 个持有者, 返回自身."""
+        self.ring.retain(self.slot, n)
+        return self
+
+    def release(self):
+        """当前持有者释放该帧."""
+        self.ring.release(self.slot)
+
+
+class FrameRing:
+    """固定容量的帧环. 解码线程(唯一写者)申请空闲槽位并直接解码到槽位内存, 稳定运行后不再分配帧内存.
+
+    Args:
+        slots (int): 槽位数.
+        shape (tuple): 帧尺寸 (h, w, c).
+    """
+    def __init__(self, slots: int, shape: tuple):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.buffers = np.empty((slots, *self.shape), dtype=np.uint8)
+        self.refs = [FrameRef(self, slot) for slot in range(slots)]
+        self.refcounts = [0] * slots
+        self.free = deque(range(slots))
+        self.lock = Lock()
+
+    def acquire(self):
+        """申请一个空闲槽位, 调用者为唯一持有者; 槽位全被占用时返回 None.
+
+        Returns:
+            ref (FrameRef): 写者通过 buffers[ref.slot] 写入帧.
+        """
+        with self.lock:
+            if not self.free:
+                return None
+            slot = self.free.popleft()
+            self.refcounts[slot] = 1
+        return self.refs[slot]
+
+    def retain(self, slot: int, n: int = 1):
+        with self.lock:
+            assert self.refcounts[slot] > 0, '帧环槽位 {} 已被回收'.format(slot)
+            self.refcounts[slot] += n
+
+    def release(self, slot: int):
+        with self.lock:
+            assert self.refcounts[slot] > 0, '帧环槽位 {} 重复释放'.format(slot)
+            self.refcounts[slot] -= 1
+            if self.refcounts[slot] == 0:
+                self.free.append(slot)
+
+    def in_use(self) -> int:
+        """被占用的槽位数."""
+        with self.lock:
+            return self.slots - len(self.free)
@@ -7,65 +7,239 @@ Author: gaoy
 Time: 2023/8/3
 """
 import logging
-import os
 import os.path as op
 import queue
 import sys
 import threading
+import time
 from AIDetector_pytorch import Detector
+from tools import metrics
+from tools.deadline import LatencyBudget
+from tools.detection_cache import DetectionCache
+from tools.resolution import ResolutionController
+from tools.device_policy import bind_device, resolve_device
 
 class Gpuslave:
     """
     gpu模块
     """
     def __init__(self, name: str,
-            cfg_model: dict, q_pic_my: queue.Queue, exc_bucket):
+            cfg_model: dict, q_pic_my: queue.Queue, exc_bucket, latency_budget_ms: float = None, ready=None,
+            preprocess_cache=None):
         """
         初始化函数
         Args:
             name: 模型名字
             cfg_model: 模型配置信息
             q_pic_my: 待推理队列
+            latency_budget_ms: 帧时延预算毫秒数, 出队时超出预算的帧不再推理
+            ready: 模型载入并预热完成后 set 的事件, 默认新建 threading.Event
+            preprocess_cache: 同进程各模型共享的预处理缓存, 同一帧只缩放一次; None 为不共享
         """
         self.name = name
-        self.img_resize = 320
+        self.img_resize = cfg_model.get('IMG_SIZE', 320)
         self.cfg_model = cfg_model
         self.q_pic_my = q_pic_my
         self.exc_bucket = exc_bucket
         self.threshold = 0.25
         self.stride = 32
+        self.budget = LatencyBudget(latency_budget_ms)
+        self.ready = ready or threading.Event()
+        self.preprocess_cache = preprocess_cache
+
+        #近重复帧检测结果缓存: 与缓存帧的感知哈希足够接近的帧直接沿用其检测结果
+        cfg_dedup = self.cfg_model.get('DEDUP', {})
+        self.detection_cache = DetectionCache(
+            'gpuslave.{}'.format(self.name),
+            maxsize=cfg_dedup.get('MAX_SIZE', 16),
+            hash_size=cfg_dedup.get('HASH_SIZE', 16),
+            max_distance=cfg_dedup.get('MAX_DISTANCE', 2),
+        ) if cfg_dedup.get('ENABLE', False) else None
+
+        #动态批处理配置, MAX_SIZE<=1 时逐帧推理
+        cfg_batch = self.cfg_model.get('BATCH', {})
+        self.max_batch = cfg_batch.get('MAX_SIZE', 1)
+        self.max_wait = cfg_batch.get('MAX_WAIT_MS', 10) / 1000
+
+        self.hist_batch = metrics.histogram(
+            'gpuslave.{}.batch_size'.format(self.name), [1, 2, 4, 8, 16, 32, 64])
+        self.hist_wait = metrics.histogram(
+            'gpuslave.{}.queue_wait_ms'.format(self.name), [5, 10, 20, 50, 100, 200, 500, 1000, 2000])
+        self.hist_infer = metrics.histogram(
+            'gpuslave.{}.infer_ms'.format(self.name), [5, 10, 20, 50, 100, 200, 500, 1000, 2000])
+        self.hist_stages = {}  # 检测器分阶段耗时, k=阶段名
+
+        #自适应推理尺寸: 按队列积压与推理耗时, 在尺寸阶梯上为各摄像头升降档
+        cfg_adaptive = self.cfg_model.get('ADAPTIVE', {})
+        self.resolution = ResolutionController(
+            self.name,
+            ladder=cfg_adaptive.get('LADDER', [640, 480, 320]),
+            stride=self.stride,
+            target_ms=cfg_adaptive.get('TARGET_MS', 100),
+            high_queue=cfg_adaptive.get('HIGH_QUEUE', 16),
+            low_queue=cfg_adaptive.get('LOW_QUEUE', 2),
+            cooldown=cfg_adaptive.get('COOLDOWN_S', 5),
+        ) if cfg_adaptive.get('ENABLE', False) else None
+        self.warm_shapes = set()  # 已按尺寸阶梯预热过的帧尺寸
 
         self.logger = logging.getLogger('log')
-        self.logger.info('gpuslave({}) inited with img_resize={}.'.format(self.name, self.img_resize))
+        self.logger.info('gpuslave({}) inited with img_resize={}, max_batch={}, max_wait={}ms.'.format(
+            self.name, self.img_resize, self.max_batch, self.max_wait * 1000))
+
+    def collect_batch(self, q_pic_my: queue.Queue) -> list:
+        """
+        从待推理队列收集一批图片: 阻塞取第一张, 之后至多等待 max_wait 秒, 凑满 max_batch 张即返回.
+        超出时延预算的图片直接丢弃, 返回的批可能为空.
+        Args:
+            q_pic_my: 待推理队列
+        """
+        items = [q_pic_my.get()]
+        deadline = time.time() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(q_pic_my.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        now = time.time()
+        self.hist_batch.observe(len(items))
+        for item in items:
+            self.hist_wait.observe((now - item[-1]) * 1000)  # 入队时刻起算, 不含抽帧/排序等上游耗时
+
+        kept = []
+        for item in items:
+            if self.budget.expired(item[1], now):
+                self.discard(item)
+            else:
+                kept.append(item)
+        return kept
+
+    def discard(self, item: tuple):
+        """
+        丢弃超出时延预算的图片, 释放帧引用
+        Args:
+            item: (waiting_queue, timestamp, 帧引用, roi, 入队时刻)
+        """
+        waiting_queue, timestamp, ref, _, _ = item
+        self.budget.drop(waiting_queue, timestamp, 'slave')
+        ref.release()
+
+    def warmup(self, model):
+        """
+        启动预热: 按 WARMUP.SHAPES 中的每种帧尺寸 x 每档推理尺寸 x 每种批大小跑一次空白批,
+        首批真实帧不再承担缓冲区分配与 cudnn 选算法的开销
+        Args:
+            model: 检测器
+        """
+        shapes = [(*shape, 3) for shape in self.cfg_model.get('WARMUP', {}).get('SHAPES', [])]
+        t0 = time.time()
+        for shape in shapes:
+            self.warm_shape(model, shape)
+        if shapes:
+            self.logger.info('gpuslave({}) warmup done in {:.2f}s.'.format(self.name, time.time() - t0))
+
+    def warm_shape(self, model, shape: tuple):
+        """
+        预热一种帧尺寸: 每档推理尺寸 x 每种批大小(WARMUP.BATCH_SIZES, 默认 1..BATCH.MAX_SIZE)各跑一次空白批
+        Args:
+            model: 检测器
+            shape: 帧尺寸 (h, w, c)
+        """
+        img_sizes = self.resolution.ladder if self.resolution is not None else [self.img_resize]
+        batch_sizes = self.cfg_model.get('WARMUP', {}).get('BATCH_SIZES') or range(1, self.max_batch + 1)
+        for size in img_sizes:
+            for n in batch_sizes:
+                dt = model.warmup(shape, size, n)
+                self.logger.info('gpuslave({}) warmup shape={} img_size={} batch={}: {:.1f}ms.'.format(
+                    self.name, shape, size, n, dt * 1000))
+        self.warm_shapes.add(shape)
+
+    def detect(self, model, frames: list, rois: list, cameras: list, keys: list = None) -> list:
+        """
+        一批图片前向推理, 并把负载反馈给自适应尺寸控制器
+        Args:
+            model: 检测器
+            frames: 图片列表
+            rois: 各图片的检测区域
+            cameras: 各图片所属摄像头, 推理尺寸按摄像头调节
+            keys: 各图片的预处理缓存键
+        """
+        img_sizes = None
+        if self.resolution is not None:
+            #新的帧尺寸(未在 WARMUP.SHAPES 中, 如摄像头重连后分辨率变化): 与启动预热相同, 预热全部档位 x 全部批大小,
+            #避免之后切换档位或批大小时卡顿. 预热在推理线程内进行, 本批及排队中的帧会停顿 档位数 x 批大小数 次空白推理的时间
+            for shape in {frame.shape for frame in frames} - self.warm_shapes:
+                t0 = time.time()
+                self.warm_shape(model, shape)
+                self.logger.warning('gpuslave({}) 新帧尺寸 {} 运行时预热, 推理停顿 {:.2f}s; 可加入 WARMUP.SHAPES 在启动时预热.'.format(
+                    self.name, shape, time.time() - t0))
+            img_sizes = [self.resolution.size(camera) for camera in cameras]
+
+        t0 = time.time()
+        results = model.detect_batch(frames, rois=rois, img_sizes=img_sizes, keys=keys, cameras=cameras)
+        infer_ms = (time.time() - t0) * 1000
+        if not model.inferred:  # 整批命中近重复帧缓存, 耗时不代表推理负载, 不计入耗时也不反馈给尺寸控制器
+            return results
+        self.hist_infer.observe(infer_ms)
+        for stage, ms in model.timings.items():
+            if stage not in self.hist_stages:
+                self.hist_stages[stage] = metrics.histogram('gpuslave.{}.{}_ms'.format(self.name, stage),
+                                                            [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+            self.hist_stages[stage].observe(ms)
+        if self.resolution is not None:
+            self.resolution.update(self.q_pic_my.qsize(), infer_ms)
+        return results
+
+    def infer(self, model, items: list):
+        """
+        一批图片一次前向推理, 结果按时间戳送回各自摄像头的等待队列
+        Args:
+            model: 检测器
+            items: collect_batch 收集的 (waiting_queue, timestamp, 帧引用, roi, 入队时刻)
+        """
+        results = self.detect(model, [ref.frame for _, _, ref, _, _ in items], [roi for _, _, _, roi, _ in items],
+                              [waiting_queue.name for waiting_queue, _, _, _, _ in items],
+                              [(id(ref.ring), ref.slot, timestamp) for _, timestamp, ref, _, _ in items])  # 帧存活期间唯一
+        for (waiting_queue, timestamp, ref, _, _), (_, predict) in zip(items, results):
+            waiting_queue.putitem(timestamp, (ref, predict))  # 帧引用随结果交给推流线程释放
+
+    def setup_threads(self):
+        """推理线程数为进程级设置, threading 模式下各 slave 共用, 由主程序统一设置, 这里不做处理."""
 
     def app(self, q_pic_my: queue.Queue, exc_bucket):
         """gpu模块主函数"""
         
-        #设置使用的显卡
-        if 'DEVICE' in self.cfg_model.keys():
-            os.environ['CUDA_VISIBLE_DEVICES'] = self.cfg_model['DEVICE']
-        
         try:
-            if self.name == "man":
-                #载入模型
-                model = Detector(img_size = self.img_resize, cfg_model = self.cfg_model, threshold = self.threshold, stride = self.stride)
-                self.logger.info('ok. Model {} loaded. Begin running.'.format(self.name))
-            
+            #绑定本线程使用的显卡(线程级, 不改写进程级的 CUDA_VISIBLE_DEVICES), 设置推理线程数
+            bind_device(resolve_device(self.cfg_model.get('DEVICE', 'cpu')))
+            self.setup_threads()
+
+            #载入模型
+            model = Detector(img_size = self.img_resize, cfg_model = self.cfg_model, threshold = self.threshold, stride = self.stride,
+                             preprocess_cache = self.preprocess_cache, detection_cache = self.detection_cache)
+            self.logger.info('gpuslave({}) model loaded in {:.2f}s ({}).'.format(self.name, model.load_time,
+                {True: '命中缓存', False: '已写入缓存', None: '未缓存'}[model.cache_hit]))
+            if self.resolution is not None and model.m.input_shape:
+                self.logger.warning('gpuslave({}) 模型输入尺寸固定为 {}, 不支持自适应推理尺寸.'.format(
+                    self.name, model.m.input_shape))
+                self.resolution = None
+            self.warmup(model)
+            self.logger.info('ok. Model {} loaded. Begin running.'.format(self.name))
+            self.ready.set()
+
         except Exception as err:
-            self.logger.fatal('模型未成功部署在GPU上!详细信息: {}'.format(err.message))
+            self.logger.fatal('模型未成功部署在GPU上!详细信息: {}'.format(err))
             exc_bucket.put(sys.exc_info())
             return
         
         try:
             while True:
-                imginfo: tuple = q_pic_my.get()
-                img = imginfo[-1]
-                if self.name == "man":
-                    #对每张待推理图片进行推理
-                    frame, predict = model.detect(img)
-                    waiting_queue = imginfo[0]
-                    timestamp = imginfo[1]
-                    waiting_queue.putitem(timestamp, (frame, predict))
+                items = self.collect_batch(q_pic_my)
+                if len(items) > 0:
+                    self.infer(model, items)
                     
         except Exception as err:
             self.logger.fatal('模型 {} 出错, 详细信息: {}'.format(self.name, err))
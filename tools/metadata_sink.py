@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: metadata_sink.py
+Desc: 检测元数据输出: 每帧检测结果按抽帧时间戳发布到本地 socket 或文件, 客户端自行叠加到原视频流
+Author: gaoy
+Time: 2026/10/17
+"""
+import json
+import logging
+import os
+import socket
+import struct
+from tools import detections
+from tools import metrics
+
+# 二进制帧头(小端): 魔数, 抽帧时间戳(秒), 帧宽, 帧高, 框数, 模型名长度; 其后为模型名(utf-8)与框记录(detections.WIRE_DTYPE)
+BIN_HEADER = struct.Struct('<4sdHHHB')
+BIN_MAGIC = b'RTPD'
+
+
+class MetadataSink:
+    """检测元数据发布器.
+
+    目标:
+        udp://host:port    每帧一个 UDP 数据报.
+        unix:///path.sock  每帧一个 unix 数据报, 由客户端创建并监听该路径.
+        其他               视为文件路径, 追加写入.
+    socket 为非阻塞, 无人监听或缓冲区满时丢弃该帧(计入 camera.<name>.metadata.dropped), 不阻塞结果消费.
+
+    格式:
+        json    每帧一行 {"camera", "model", "ts", "w", "h", "dets": [[x1, y1, x2, y2, lbl, conf], ...]}.
+        binary  BIN_HEADER + 模型名 + 每框 28 字节记录.
+
+    Args:
+        name (str): 摄像头名.
+        target (str): 输出目标.
+        fmt (str): json/binary.
+    """
+    def __init__(self, name: str, target: str, fmt: str = 'json'):
+        assert fmt in ('json', 'binary'), '未知元数据格式 {}, 可选 json/binary'.format(fmt)
+        self.name = name
+        self.target = target
+        self.fmt = fmt
+        self.logger = logging.getLogger('log')
+        self.failing = False  # 上一帧是否发送失败, 仅在状态切换时记日志
+
+        self.sock = self.file = None
+        if target.startswith('udp://'):
+            host, port = target[len('udp://'):].rsplit(':', 1)
+            self.addr = (host, int(port))
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        elif target.startswith('unix://'):
+            self.addr = target[len('unix://'):]
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            self.file = open(target, 'ab')
+        if self.sock is not None:
+            self.sock.setblocking(False)
+
+        self.sent = metrics.counter('camera.{}.metadata.sent'.format(name))
+        self.dropped = metrics.counter('camera.{}.metadata.dropped'.format(name))
+
+    def encode(self, model: str, timestamp: float, shape: tuple, dets) -> bytes:
+        """编码一帧的检测结果."""
+        h, w = shape[:2]
+        if self.fmt == 'json':
+            return json.dumps({'camera': self.name, 'model': model, 'ts': timestamp, 'w': w, 'h': h,
+                               'dets': detections.to_list(dets)}, ensure_ascii=False).encode('utf-8') + b'\n'
+        model_bytes = model.encode('utf-8')
+        return BIN_HEADER.pack(BIN_MAGIC, timestamp, w, h, len(dets), len(model_bytes)) + model_bytes \
+            + detections.to_bytes(dets)
+
+    def publish(self, model: str, timestamp: float, shape: tuple, dets):
+        """发布一帧的检测结果.
+
+        Args:
+            model (str): 模型名.
+            timestamp (float): 抽帧时间戳, 客户端据此与原视频帧对齐.
+            shape (tuple): 原帧尺寸, 检测框为原帧坐标.
+            dets (np.ndarray): 检测结果(见 tools/detections.py).
+        """
+        data = self.encode(model, timestamp, shape, dets)
+        try:
+            if self.sock is not None:
+                self.sock.sendto(data, self.addr)
+            else:
+                self.file.write(data)
+                self.file.flush()
+        except OSError as err:  # 无人监听/缓冲区满/磁盘错误
+            self.dropped.inc()
+            if not self.failing:
+                self.logger.warning('camera {} 元数据发送到 {} 失败: {}'.format(self.name, self.target, err))
+                self.failing = True
+            return
+        if self.failing:
+            self.logger.info('camera {} 元数据发送到 {} 已恢复.'.format(self.name, self.target))
+            self.failing = False
+        self.sent.inc()
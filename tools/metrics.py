@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: metrics.py
+Desc: 运行指标模块(直方图/计数器), 由监控模块定期导出
+Author: gaoy
+Time: 2026/10/17
+"""
+import bisect
+import json
+import threading
+
+_registry = {}  # 全局指标表, k=指标名, v=指标对象
+_registry_mutex = threading.Lock()
+
+
+class Histogram:
+    """线程安全的分桶直方图.
+
+    Args:
+        name (str): 指标名.
+        buckets (list): 各桶上界(升序), 超出最大上界的值计入 '+Inf' 桶.
+    """
+    def __init__(self, name: str, buckets):
+        self.name = name
+        self.buckets = sorted(buckets)
+        self.mutex = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """记录一个观测值."""
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.mutex:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> dict:
+        """返回当前直方图快照."""
+        with self.mutex:
+            counts = list(self.counts)
+            count, total = self.count, self.sum
+        labels = ['<={:g}'.format(b) for b in self.buckets] + ['+Inf']
+        return {
+            'type': 'histogram',
+            'count': count,
+            'mean': total / count if count else 0.0,
+            'buckets': dict(zip(labels, counts)),
+        }
+
+
+class Counter:
+    """线程安全的计数器.
+
+    Args:
+        name (str): 指标名.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.mutex = threading.Lock()
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        """计数加 n."""
+        with self.mutex:
+            self.value += n
+
+    def snapshot(self) -> dict:
+        """返回当前计数快照."""
+        return {'type': 'counter', 'value': self.value}
+
+
+def histogram(name: str, buckets) -> Histogram:
+    """获取(不存在则创建)名为 name 的直方图."""
+    with _registry_mutex:
+        if name not in _registry:
+            _registry[name] = Histogram(name, buckets)
+        return _registry[name]
+
+
+def counter(name: str) -> Counter:
+    """获取(不存在则创建)名为 name 的计数器."""
+    with _registry_mutex:
+        if name not in _registry:
+            _registry[name] = Counter(name)
+        return _registry[name]
+
+
+def snapshot_all() -> dict:
+    """返回全部指标的快照, k=指标名."""
+    with _registry_mutex:
+        metrics = list(_registry.items())
+    return {name: metric.snapshot() for name, metric in metrics}
+
+
+def dump(path: str):
+    """将全部指标快照写入 json 文件."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot_all(), f, ensure_ascii=False, indent=2)
@@ -6,10 +6,14 @@ Desc: 监控模块
 Author: gaoy
 Time: 2023/8/3
 """
+import json
 import logging
+import os.path as op
 import sys
 import time
 import threading
+from tools import metrics
+from tools.logger import main_dir
 
 logger = logging.getLogger('log')
 
@@ -17,9 +21,10 @@ class Monitor():
     """
     监控类, 使用该类可对程序部分内容进行监控, 并输出到日志中.
     """
-    def __init__(self, exc_bucket):
+    def __init__(self, exc_bucket, metrics_name='metrics'):
         self.max_time_gap = 3600
         self.exc_bucket = exc_bucket
+        self.metrics_path = op.join(main_dir, 'logs', metrics_name + '.json')  # 指标快照导出位置, 多进程时每个进程一份
 
     def check_queue(self, qname: str, q):
         """检查一个 queue 并输出检查结果."""
@@ -38,6 +43,13 @@ class Monitor():
             logger.warning('monitor checking: {}.qsize()=={}/{}. Queue is too full.'.format(qname, qsize, maxsize))
             return 'warning'
 
+    def export_metrics(self):
+        """将运行指标(批大小/排队时延直方图等)输出到日志, 并导出快照到 logs/metrics.json."""
+        snapshot = metrics.snapshot_all()
+        for name, value in snapshot.items():
+            logger.info('monitor metrics: {} {}'.format(name, json.dumps(value)))
+        metrics.dump(self.metrics_path)
+
     def app(self, qs: dict):
         try:
             timegap = 10
@@ -51,6 +63,9 @@ class Monitor():
                     status = self.check_queue(qname, q)
                     if status == 'warning':
                         timegap = 10
+
+                # 导出运行指标
+                self.export_metrics()
         except Exception:
             self.exc_bucket.put(sys.exc_info())
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: motion.py
+Desc: 运动检测(缩小的灰度图与滑动平均背景作差), 静止画面跳过推理
+Author: gaoy
+Time: 2026/10/17
+"""
+import cv2
+import numpy as np
+
+
+class MotionDetector:
+    """基于滑动平均背景的轻量运动检测.
+
+    帧缩小到 width 宽的灰度图后与背景作差, 变化像素占比超过 min_area 即判为运动.
+    滞回: 检测到运动立即进入运动状态, 连续 hold 秒无运动才退出, 防止人短暂静止时漏检.
+
+    Args:
+        width (int): 缩小后的宽度.
+        pixel_thresh (int): 像素灰度差阈值.
+        min_area (float): 变化像素占比阈值.
+        hold (float): 无运动多少秒后判为静止.
+        alpha (float): 背景更新速率.
+    """
+    def __init__(self, width: int = 160, pixel_thresh: int = 25, min_area: float = 0.002,
+            hold: float = 2.0, alpha: float = 0.05):
+        self.width = width
+        self.pixel_thresh = pixel_thresh
+        self.min_area = min_area
+        self.hold = hold
+        self.alpha = alpha
+
+        self.moving = True
+        self.last_motion = None  # 上次检测到运动的时间
+        self.shape = None  # 缓冲区对应的原帧尺寸
+        self.small = self.gray = self.background = self.background_u8 = self.diff = None
+
+    def _alloc(self, shape: tuple):
+        """按帧尺寸分配缓冲区, 之后每帧复用."""
+        h, w = shape[:2]
+        size = (max(1, round(h * self.width / w)), self.width)
+        self.shape = shape
+        self.small = np.empty((*size, 3), dtype=np.uint8)
+        self.gray = np.empty(size, dtype=np.uint8)
+        self.background = np.empty(size, dtype=np.float32)
+        self.background_u8 = np.empty(size, dtype=np.uint8)
+        self.diff = np.empty(size, dtype=np.uint8)
+
+    def update(self, frame: np.ndarray, timestamp: float) -> bool:
+        """输入一帧, 返回当前是否处于运动状态.
+
+        Args:
+            frame (np.ndarray): BGR 帧(只读即可).
+            timestamp (float): 帧时间(秒).
+        """
+        if frame.shape != self.shape:  # 首帧或帧尺寸变化, 重建背景
+            self._alloc(frame.shape)
+            cv2.resize(frame, self.small.shape[1::-1], dst=self.small, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+            self.background[:] = self.gray
+            self.moving, self.last_motion = True, timestamp
+            return self.moving
+
+        cv2.resize(frame, self.small.shape[1::-1], dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        cv2.convertScaleAbs(self.background, dst=self.background_u8)
+        cv2.absdiff(self.gray, self.background_u8, dst=self.diff)
+        cv2.threshold(self.diff, self.pixel_thresh, 255, cv2.THRESH_BINARY, dst=self.diff)
+        cv2.accumulateWeighted(self.gray, self.background, self.alpha)
+
+        if cv2.countNonZero(self.diff) > self.min_area * self.diff.size:
+            self.moving, self.last_motion = True, timestamp
+        elif timestamp - self.last_motion > self.hold:
+            self.moving = False
+        return self.moving
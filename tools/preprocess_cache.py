@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: preprocess_cache.py
+Desc: 多模型共享的预处理缓存: 同一帧(同一裁剪区域)同一推理尺寸只缩放/转置一次
+Author: gaoy
+Time: 2026/10/17
+"""
+import threading
+from collections import OrderedDict
+from tools import metrics
+
+
+class PreprocessCache:
+    """线程安全的 LRU 缓存, 存放缩放后的 RGB CHW uint8 图像, 供同进程内各模型的检测器复用.
+
+    键由调用方保证在帧存活期间唯一, 如 (帧环 id, 槽位, 时间戳, 裁剪区域, 推理尺寸).
+    两个模型同时未命中同一键时各自计算一次, 不互相等待.
+
+    Args:
+        maxsize (int): 最大条目数.
+    """
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self.mutex = threading.Lock()
+        self.items = OrderedDict()
+        self.hits = metrics.counter('preprocess.cache.hits')
+        self.misses = metrics.counter('preprocess.cache.misses')
+
+    def get(self, key, build):
+        """返回 key 对应的图像, 未命中时调用 build() 生成并缓存."""
+        with self.mutex:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+                self.hits.inc()
+                return value
+        self.misses.inc()
+        value = build()  # 锁外计算, 不阻塞其他模型
+        with self.mutex:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+        return value
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: processing.py
+Desc: 多进程运行模式: 摄像头进程与推理进程, 帧经共享内存环传递, 队列中只传槽位句柄
+Author: gaoy
+Time: 2026/10/17
+"""
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import traceback
+from tools.cameras import Camera
+from tools.device_policy import apply_threads
+from tools.gpu_slaves import Gpuslave
+from tools.logger import setup_log
+from tools.monitor import Monitor
+from tools.shm_ring import ShmFrameRing
+
+
+class ProcessExcBucket:
+    """子进程异常桶. traceback 对象不可序列化, 转为字符串后经进程队列交给主进程.
+
+    Args:
+        exc_queue: 主进程的异常队列(multiprocessing.Queue).
+    """
+    def __init__(self, exc_queue):
+        self.exc_queue = exc_queue
+
+    def put(self, exc_info):
+        e_type, e_value, e_traceback = exc_info
+        self.exc_queue.put((e_type, str(e_value), ''.join(traceback.format_exception(e_type, e_value, e_traceback))))
+
+
+class ProcessCamera(Camera):
+    """多进程模式下的摄像头模块: 帧写入本进程的共享内存环, 向推理进程只发送 (摄像头名, 时间戳, 帧句柄).
+
+    本地帧引用保留到推理结果返回, 推流直接使用本地帧, 结果回程不再拷贝.
+
+    Args:
+        q_result: 本摄像头的推理结果队列(multiprocessing.Queue).
+        ring_slots: 共享内存环(及本地帧环)槽位数.
+        其余参数同 Camera.
+    """
+    def __init__(self, name: str, fps: int, cfg_camera: dict,
+            q_pic: dict, exc_bucket, q_result, ring_slots: int, max_reorder_ms: float = None,
+            latency_budget_ms: float = None):
+        super(ProcessCamera, self).__init__(name, fps, cfg_camera, q_pic, exc_bucket,
+            ring_slots=ring_slots, max_reorder_ms=max_reorder_ms, latency_budget_ms=latency_budget_ms)
+        self.q_result = q_result
+        self.ring_slots = ring_slots
+        self.pending = {}  # 等待推理结果的本地帧引用, k=(模型名, 时间戳)
+        self.ring = None  # 当前写入的帧环
+        self.rings = {}  # 仍可能被引用的帧环, k=共享内存名
+        self.generation = 0  # 帧尺寸变化(如重连)时重建帧环
+
+    def get_ring(self, shape: tuple) -> ShmFrameRing:
+        """获取与帧尺寸匹配的帧环, 尺寸变化时新建, 并销毁更早的帧环."""
+        if self.ring is None or self.ring.shape != tuple(shape):
+            name = 'rtpd_{}_{}'.format(os.getpid(), self.generation)
+            self.generation += 1
+            self.ring = ShmFrameRing(name, self.ring_slots, shape, create=True)
+            self.rings[self.ring.name] = self.ring
+            while len(self.rings) > 2:  # 保留上一代供在途帧挂载
+                old = self.rings.pop(next(iter(self.rings)))
+                old.close()
+                old.unlink()
+            self.logger.info('camera {} 帧环 {} 已创建, {} 槽位, 帧尺寸 {}.'.format(
+                self.name, self.ring.name, self.ring_slots, shape))
+        return self.ring
+
+    def send_frame(self):
+        """
+        发送待推理图片句柄
+        """
+        try:
+            self.setup_waiting_queues()
+            threading.Thread(target=self.collect_results, args=()).start()
+            while True:
+                timestamp, ref, infer = self.video_getter.get()
+                if infer:
+                    ring = self.get_ring(ref.frame.shape)
+                    slot, seq = ring.write(ref.frame)
+                for model in self.model_types:
+                    if model in self.q_pic.keys():
+                        if not infer:
+                            self.reuse_predict(model, timestamp, ref)
+                            continue
+                        self.pred_waiting_queue[model].putstamp(timestamp)
+                        if self.budget.expired(timestamp):  # 抽帧后积压过久
+                            self.budget.drop(self.pred_waiting_queue[model], timestamp, 'camera')
+                            continue
+                        self.pending[(model, timestamp)] = ref.retain()
+                        try:
+                            self.q_pic[model].put_nowait((self.name, timestamp, ring.handle(slot, seq), self.roi, time.time()))
+                        except queue.Full:  # 推理进程积压, 丢弃本帧(跨进程无法安全丢弃队首其他摄像头的帧)
+                            self.pending.pop((model, timestamp)).release()
+                            self.pred_waiting_queue[model].removestamp(timestamp)
+                ref.release()
+
+        except Exception:
+            self.exc_bucket.put(sys.exc_info())
+
+    def collect_results(self):
+        """
+        接收推理进程返回的结果, 与本地帧引用配对后按时间戳放入等待队列
+        """
+        try:
+            while True:
+                model, timestamp, handle, predict = self.q_result.get()
+                waiting_queue = self.pred_waiting_queue[model]
+                ref = self.pending.pop((model, timestamp))
+                if predict is None:  # 推理进程丢弃了该帧(共享内存槽位已被覆盖)
+                    ref.release()
+                    waiting_queue.removestamp(timestamp)
+                    continue
+                waiting_queue.putitem(timestamp, (ref, predict))
+        except Exception:
+            self.exc_bucket.put(sys.exc_info())
+
+
+class ProcessGpuslave(Gpuslave):
+    """多进程模式下的推理模块: 按句柄从各摄像头的共享内存环取帧, 结果发回对应摄像头进程.
+
+    Args:
+        q_results: 各摄像头的推理结果队列, k=摄像头名.
+        其余参数同 Gpuslave.
+    """
+    def __init__(self, name: str, cfg_model: dict, q_pic_my, exc_bucket, q_results: dict,
+            latency_budget_ms: float = None, ready=None):
+        super(ProcessGpuslave, self).__init__(name, cfg_model, q_pic_my, exc_bucket, latency_budget_ms, ready)
+        self.q_results = q_results
+        self.rings = {}  # 已挂载的帧环, k=共享内存名
+        self.generations = {}  # 各摄像头已挂载的最新帧环代数, k=帧环名前缀(摄像头进程号)
+        self.stale = []  # 已淘汰但仍有帧视图引用、尚未关闭的帧环
+
+    def setup_threads(self):
+        """本进程只运行一个 slave, 按本模型配置设置推理线程数."""
+        cfg_threads = self.cfg_model.get('THREADS', {})
+        apply_threads(cfg_threads.get('INTRA_OP'), cfg_threads.get('INTER_OP'))
+
+    def attach(self, handle: tuple):
+        """挂载句柄对应的帧环, 帧环已被摄像头进程销毁则返回 None."""
+        name, slots, shape, _, _ = handle
+        if name not in self.rings:
+            camera, generation = name.rsplit('_', 1)  # ProcessCamera.get_ring 命名为 rtpd_<进程号>_<代数>
+            newest = self.generations.get(camera, -1)
+            if int(generation) < newest - 1:  # 摄像头进程只保留最近两代, 更早的已销毁
+                return None
+            try:
+                self.rings[name] = ShmFrameRing(name, slots, shape)
+            except FileNotFoundError:
+                return None
+            self.generations[camera] = max(newest, int(generation))
+        return self.rings[name]
+
+    def evict(self):
+        """关闭各摄像头最近两代以前的帧环(摄像头进程已销毁), 防止帧尺寸多次变化后映射越积越多.
+
+        仍有帧视图引用的帧环暂不关闭, 留待下次.
+        """
+        for name in list(self.rings):
+            camera, generation = name.rsplit('_', 1)
+            if int(generation) < self.generations[camera] - 1:
+                self.stale.append(self.rings.pop(name))
+        for ring in list(self.stale):
+            if not ring.in_use():
+                ring.close()
+                self.stale.remove(ring)
+
+    def discard(self, item: tuple):
+        """
+        丢弃超出时延预算的帧, 通知摄像头进程释放该帧
+        Args:
+            item: (摄像头名, timestamp, 帧句柄, roi, 入队时刻)
+        """
+        camera, timestamp, handle, _, _ = item
+        self.budget.count('camera.{}.{}'.format(camera, self.name), 'slave')
+        self.q_results[camera].put((self.name, timestamp, handle, None))
+
+    def infer(self, model, items: list):
+        """
+        一批帧句柄一次前向推理, 结果发回各自摄像头进程
+        Args:
+            model: 检测器
+            items: collect_batch 收集的 (摄像头名, timestamp, 帧句柄, roi, 入队时刻)
+        """
+        frames, rois, kept = [], [], []
+        for camera, timestamp, handle, roi, _ in items:
+            ring = self.attach(handle)
+            frame = ring.read(*handle[3:]) if ring is not None else None
+            if frame is None:  # 排队期间已被覆盖
+                self.q_results[camera].put((self.name, timestamp, handle, None))
+                continue
+            frames.append(frame)
+            rois.append(roi)
+            kept.append((camera, timestamp, handle))
+
+        results = self.detect(model, frames, rois, [camera for camera, _, _ in kept]) if frames else []
+        for (camera, timestamp, handle), (_, predict) in zip(kept, results):
+            if not self.rings[handle[0]].valid(*handle[3:]):  # 推理期间被覆盖, 结果作废
+                predict = None
+            self.q_results[camera].put((self.name, timestamp, handle, predict))
+        frames = frame = None  # 释放帧视图后才能关闭帧环
+        self.evict()
+
+
+def camera_main(name: str, fps: int, cfg_camera: dict, q_pic: dict, q_result, exc_queue, ring_slots: int,
+        max_reorder_ms: float = None, latency_budget_ms: float = None):
+    """摄像头进程入口."""
+    setup_log()
+    exc_bucket = ProcessExcBucket(exc_queue)
+    camera = ProcessCamera(name, fps, cfg_camera, q_pic, exc_bucket, q_result, ring_slots,
+        max_reorder_ms, latency_budget_ms)
+    camera.run()
+    #监控本进程的取流队列并导出本进程的 camera.* 指标, 摄像头名可能含路径分隔符, 文件名中替换掉
+    Monitor(exc_bucket, metrics_name='metrics-camera-{}'.format(re.sub(r'[^\w.-]', '_', name))).run(
+        {'q_camera_{}'.format(name): camera.video_getter.waiting_queue.queue})
+
+
+def slave_main(name: str, worker: int, cfg_model: dict, q_pic_my, q_results: dict, exc_queue,
+        latency_budget_ms: float = None, ready=None):
+    """推理进程入口."""
+    setup_log()
+    exc_bucket = ProcessExcBucket(exc_queue)
+    slave = ProcessGpuslave(name, cfg_model, q_pic_my, exc_bucket, q_results, latency_budget_ms, ready)
+    slave.run()
+    Monitor(exc_bucket, metrics_name='metrics-{}-{}'.format(name, worker)).run({})  # 导出本进程的指标
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: resolution.py
+Desc: 按负载自适应调节各摄像头的推理尺寸
+Author: gaoy
+Time: 2026/10/17
+"""
+import logging
+import time
+from utils.general import make_divisible
+
+logger = logging.getLogger('log')
+
+
+class ResolutionController:
+    """推理尺寸控制器. 每个 slave 一个, 为其服务的各摄像头在尺寸阶梯上独立升降档.
+
+    队列积压或单批推理耗时超过目标时, 将当前尺寸最大的摄像头降一档;
+    队列空闲且耗时低于目标的 headroom 倍时, 将当前尺寸最小的摄像头升一档. 两次切换至少间隔 cooldown 秒.
+
+    Args:
+        name (str): slave 名, 用于日志.
+        ladder (list): 推理尺寸阶梯, 会对齐到 stride 的倍数并从大到小排列.
+        stride (int): 模型最大步长.
+        target_ms (float): 单批推理耗时目标(毫秒).
+        high_queue (int): 待推理队列长度超过该值视为积压.
+        low_queue (int): 待推理队列长度不超过该值视为空闲.
+        cooldown (float): 两次切换的最小间隔(秒).
+        headroom (float): 耗时低于 target_ms * headroom 才升档.
+    """
+    def __init__(self, name: str, ladder: list, stride: int = 32, target_ms: float = 100,
+            high_queue: int = 16, low_queue: int = 2, cooldown: float = 5, headroom: float = 0.6):
+        self.name = name
+        self.ladder = sorted({make_divisible(s, stride) for s in ladder}, reverse=True)
+        self.target_ms = target_ms
+        self.high_queue = high_queue
+        self.low_queue = low_queue
+        self.cooldown = cooldown
+        self.headroom = headroom
+
+        self.levels = {}  # 各摄像头在阶梯上的档位, k=摄像头, v=ladder 下标
+        self.latency = None  # 单批推理耗时的滑动平均(毫秒)
+        self.last_switch = 0
+
+    def size(self, camera) -> int:
+        """摄像头当前的推理尺寸, 新摄像头从最大尺寸开始."""
+        return self.ladder[self.levels.setdefault(camera, 0)]
+
+    def update(self, queue_depth: int, latency_ms: float, now: float = None):
+        """反馈一批推理的负载, 必要时切换一个摄像头的档位.
+
+        Args:
+            queue_depth (int): 推理后待推理队列的长度.
+            latency_ms (float): 本批推理耗时(毫秒).
+            now (float): 当前时间, 默认 time.time().
+        """
+        self.latency = latency_ms if self.latency is None else 0.8 * self.latency + 0.2 * latency_ms
+        now = now or time.time()
+        if now - self.last_switch < self.cooldown or not self.levels:
+            return
+
+        if queue_depth > self.high_queue or self.latency > self.target_ms:
+            camera = min(self.levels, key=self.levels.get)  # 尺寸最大的摄像头
+            step = 1
+        elif queue_depth <= self.low_queue and self.latency < self.target_ms * self.headroom:
+            camera = max(self.levels, key=self.levels.get)  # 尺寸最小的摄像头
+            step = -1
+        else:
+            return
+        level = self.levels[camera] + step
+        if not 0 <= level < len(self.ladder):
+            return
+
+        logger.info('gpuslave({}) {} 推理尺寸 {} -> {} (队列 {}, 耗时 {:.1f}ms).'.format(
+            self.name, camera, self.ladder[self.levels[camera]], self.ladder[level], queue_depth, self.latency))
+        self.levels[camera] = level
+        self.last_switch = now
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: result_join.py
+Desc: 多模型结果汇合: 各模型的等待队列按序汇入同一队列, 按帧时间戳拼合各模型的结果, 不再逐个模型串行阻塞
+Author: gaoy
+Time: 2026/10/17
+"""
+import queue
+import time
+from tools import metrics
+
+
+class ResultJoin:
+    """按帧汇合各模型的推理结果.
+
+    各模型的 WaitingQueue 以 out_queue=self.queue, tag=模型名 创建, 按时间戳顺序放入 (时间戳, 项, 模型名).
+    每个模型的结果按时间戳递增到达, 所以某模型已放出更晚的时间戳而缺少本帧, 说明本帧在该模型被丢弃/跳过.
+    一帧在以下情况放出, 放出顺序按时间戳递增:
+        1. 各模型的结果都已到达;
+        2. 缺少的模型都已放出更晚的帧(部分结果);
+        3. 首个结果到达后等待超过 timeout 秒(部分结果), None 为不超时.
+    放出后才到达的结果为迟到, 经 on_drop 释放. 单消费者(结果消费线程)使用.
+    add_source() 登记的等待队列在等待期间按其队首超时时刻轮询, 结果不再到达时超时的队首照常被跳过.
+
+    Args:
+        name (str): 指标名前缀, 计数器为 <name>.join.<joined/partial/late>.
+        models (list): 参与汇合的模型名.
+        timeout (float): 最长等待秒数.
+        on_drop (callable): 迟到项的回调, 用于释放项持有的资源.
+    """
+    def __init__(self, name: str, models: list, timeout: float = None, on_drop=None):
+        self.queue = queue.Queue()
+        self.models = list(models)
+        self.timeout = timeout
+        self.on_drop = on_drop
+        self.frames = {}  # 未放出的帧, k=时间戳, v=(首个结果到达时刻, {模型名: 项})
+        self.seen = {model: float('-inf') for model in self.models}  # 各模型已放出的最晚时间戳
+        self.last = float('-inf')  # 最近放出的帧时间戳
+        self.sources = []  # 汇入本队列的等待队列
+
+        self.joined = metrics.counter('{}.join.joined'.format(name))
+        self.partial = metrics.counter('{}.join.partial'.format(name))
+        self.late = metrics.counter('{}.join.late'.format(name))
+
+    def add_source(self, waiting_queue):
+        """登记一个汇入本队列的等待队列(WaitingQueue)."""
+        self.sources.append(waiting_queue)
+
+    def add(self, stamp: float, item, model: str):
+        """记录一个模型的结果."""
+        self.seen[model] = max(self.seen[model], stamp)
+        if stamp <= self.last:
+            self.late.inc()
+            if self.on_drop is not None:
+                self.on_drop(item)
+            return
+        self.frames.setdefault(stamp, (time.monotonic(), {}))[1][model] = item
+
+    def pop_ready(self):
+        """放出时间戳最早且已可放出的帧, 没有则返回 None."""
+        if not self.frames:
+            return None
+        stamp = min(self.frames)
+        arrived, parts = self.frames[stamp]
+        if len(parts) == len(self.models):
+            self.joined.inc()
+        elif all(self.seen[model] >= stamp for model in self.models):
+            self.partial.inc()
+        elif self.timeout is not None and time.monotonic() - arrived > self.timeout:
+            self.partial.inc()
+        else:
+            return None
+        del self.frames[stamp]
+        self.last = stamp
+        return stamp, parts
+
+    def get(self) -> tuple:
+        """阻塞直到有一帧可放出.
+
+        Returns:
+            timestamp: float.
+            parts: dict, k=模型名, v=该模型的项; 部分结果时缺少被丢弃的模型.
+        """
+        while True:
+            ready = self.pop_ready()
+            if ready is not None:
+                return ready
+            waits = [source.poll() for source in self.sources]
+            if self.timeout is not None and self.frames:
+                waits.append(max(0, self.frames[min(self.frames)][0] + self.timeout - time.monotonic()))
+            waits = [wait for wait in waits if wait is not None]
+            wait = min(waits) if waits else None
+            try:
+                self.add(*self.queue.get(timeout=wait))
+            except queue.Empty:
+                continue
+            while True:  # 一并取出已到达的结果
+                try:
+                    self.add(*self.queue.get_nowait())
+                except queue.Empty:
+                    break
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: roi.py
+Desc: 摄像头检测区域(ROI): 只对多边形外接矩形推理, 丢弃区域外的检测框
+Author: gaoy
+Time: 2026/10/17
+"""
+import cv2
+import numpy as np
+
+
+class Roi:
+    """检测区域, 由一个或多个多边形组成.
+
+    顶点坐标为相对帧宽高的比例 [0, 1], 帧分辨率变化(如重连)后仍然有效.
+    检测框以底边中点(行人落脚点)是否落在任一多边形内判断去留.
+
+    Args:
+        polygons (list): 多边形列表, 每个多边形为 [[x, y], ...].
+    """
+    def __init__(self, polygons: list):
+        self.polygons = [np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in polygons]
+        assert all(len(p) >= 3 for p in self.polygons), 'ROI 多边形至少需要3个顶点'
+        self.cache = {}  # 按帧尺寸缓存像素坐标多边形与外接矩形, k=(h, w)
+
+    def _pixels(self, shape: tuple) -> tuple:
+        """返回帧尺寸 shape 下的像素坐标多边形列表与外接矩形 (x0, y0, x1, y1)."""
+        h, w = shape[:2]
+        if (h, w) not in self.cache:
+            polygons = [(p * (w, h)).astype(np.float32) for p in self.polygons]
+            points = np.concatenate(polygons)
+            x0, y0 = np.floor(points.min(0)).astype(int).clip(0, (w - 1, h - 1))
+            x1, y1 = np.ceil(points.max(0)).astype(int).clip((x0 + 1, y0 + 1), (w, h))
+            self.cache[(h, w)] = (polygons, (int(x0), int(y0), int(x1), int(y1)))
+        return self.cache[(h, w)]
+
+    def crop_box(self, shape: tuple) -> tuple:
+        """帧尺寸 shape 下 ROI 的外接矩形 (x0, y0, x1, y1)."""
+        return self._pixels(shape)[1]
+
+    def filter(self, dets: np.ndarray, shape: tuple) -> np.ndarray:
+        """丢弃底边中点不在 ROI 内的检测框.
+
+        Args:
+            dets (np.ndarray): 原帧坐标的检测结果(见 tools/detections.py).
+            shape (tuple): 原帧尺寸.
+        """
+        if len(dets) == 0:
+            return dets
+        polygons, _ = self._pixels(shape)
+        feet = np.stack([(dets['x1'] + dets['x2']) / 2, dets['y2']], 1).astype(np.float32)
+        keep = [any(cv2.pointPolygonTest(p, (float(x), float(y)), False) >= 0 for p in polygons) for x, y in feet]
+        return dets[np.array(keep, dtype=bool)]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: shm_ring.py
+Desc: 共享内存帧环形缓冲区(多进程模式下摄像头进程与推理进程间传帧)
+Author: gaoy
+Time: 2026/10/17
+"""
+import sys
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class ShmFrameRing:
+    """固定容量的共享内存帧环.
+
+    摄像头进程(唯一写者)按序号循环写入槽位, 队列中只传 (槽位, 序号);
+    读者凭序号校验槽位是否已被覆盖, 覆盖则丢弃该帧. 内存布局: [各槽位序号 int64 * slots][帧数据].
+
+    Args:
+        name (str): 共享内存名.
+        slots (int): 槽位数.
+        shape (tuple): 帧尺寸 (h, w, c).
+        create (bool): True 为创建(写者), False 为挂载已有的(读者).
+    """
+    def __init__(self, name: str, slots: int, shape: tuple, create: bool = False):
+        self.slots = slots
+        self.shape = tuple(shape)
+        header = 8 * slots
+        size = header + slots * int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.name = self.shm.name
+        self.seqs = np.ndarray((slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.frames = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=self.shm.buf, offset=header)
+        self.next_seq = 0
+        if create:
+            self.seqs[:] = -1
+
+    def write(self, frame: np.ndarray) -> tuple:
+        """写入一帧, 返回 (槽位, 序号)."""
+        seq = self.next_seq
+        slot = seq % self.slots
+        self.seqs[slot] = -1  # 写入期间标记为无效
+        self.frames[slot] = frame
+        self.seqs[slot] = seq
+        self.next_seq += 1
+        return slot, seq
+
+    def valid(self, slot: int, seq: int) -> bool:
+        """槽位中仍是序号为 seq 的帧."""
+        return self.seqs[slot] == seq
+
+    def read(self, slot: int, seq: int):
+        """返回槽位的帧视图(不拷贝), 已被覆盖则返回 None.
+
+        视图在写者覆盖该槽位后会改变, 读者拷贝/使用完成后应再次 valid() 校验.
+        """
+        return self.frames[slot] if self.valid(slot, seq) else None
+
+    def handle(self, slot: int, seq: int) -> tuple:
+        """可经队列传递的帧句柄."""
+        return (self.name, self.slots, self.shape, slot, seq)
+
+    def in_use(self) -> bool:
+        """本进程仍有帧视图引用该映射(视图的 base 均为 self.frames). 此时解除映射, 之后访问视图会段错误."""
+        return sys.getrefcount(self.frames) > 2  # self.frames 属性与本次调用参数各占一个引用
+
+    def close(self):
+        """解除本进程的映射, 调用前应确认已无帧视图(in_use())."""
+        self.seqs = self.frames = None
+        self.shm.close()
+
+    def unlink(self):
+        """销毁共享内存(仅写者调用)."""
+        self.shm.unlink()
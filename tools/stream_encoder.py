@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: stream_encoder.py
+Desc: 推流编码模块: 独立线程把绘制好的帧写入 ffmpeg, 管道阻塞时丢帧, ffmpeg 异常退出后自动重启
+Author: gaoy
+Time: 2026/10/17
+"""
+import logging
+import queue
+import subprocess as sp
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from tools import metrics
+
+
+class StreamEncoder:
+    """推流编码器.
+
+    结果消费线程从 acquire() 取一个预分配的帧缓冲, 缩放绘制后 put() 进有界队列, 编码线程以 memoryview
+    零拷贝写入 ffmpeg 标准输入, 写完归还缓冲. ffmpeg 跟不上时队列满, 丢弃最旧的帧, 结果消费不被阻塞.
+
+    输出尺寸保持原帧宽高比, 长边为 output_size(取偶数, yuv420p 要求). 输入帧时间戳取写入时的挂钟时间,
+    推流帧率即实际送达的帧率; max_fps 为帧率上限, 超出的帧在绘制前即被跳过.
+    ffmpeg 退出或管道断开后按 1s, 2s, 4s... (最长 backoff_max 秒)退避重启, 期间的帧丢弃.
+
+    Args:
+        name (str): 摄像头名, 指标名为 camera.<name>.encoder.<written/dropped/restarts>.
+        url (str): 推流地址, 含 rtsp 时以 rtsp 格式推流, 否则为 flv.
+        output_size (int): 输出长边像素数.
+        max_fps (float): 输出帧率上限, 空或0为不限.
+        exc_bucket: 异常桶.
+        maxsize (int): 待编码队列长度.
+        backoff_max (float): 重启退避的最长间隔(秒).
+    """
+    def __init__(self, name: str, url: str, output_size: int, max_fps: float = None, exc_bucket=None,
+            maxsize: int = 2, backoff_max: float = 30):
+        self.name = name
+        self.url = url
+        self.output_size = output_size
+        self.min_interval = 1 / max_fps if max_fps else 0
+        self.exc_bucket = exc_bucket
+        self.backoff_max = backoff_max
+        self.logger = logging.getLogger('log')
+
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.slots = maxsize + 2  # 队列中的帧 + 正在写入的一帧 + 正在绘制的一帧
+        self.pool = deque()  # 空闲帧缓冲
+        self.shape = None  # 当前帧缓冲尺寸 (h, w, 3)
+        self.sizes = {}  # 原帧尺寸到输出尺寸的缓存, k=(h, w), v=(h, w)
+        self.last_accept = 0  # 上次接收帧的时间
+
+        self.proc = None  # ffmpeg 进程
+        self.proc_shape = None  # ffmpeg 进程对应的帧尺寸
+        self.started = 0  # ffmpeg 启动时刻
+        self.next_start = 0  # 退避结束时刻
+        self.backoff = 1
+
+        self.written = metrics.counter('camera.{}.encoder.written'.format(name))
+        self.dropped = metrics.counter('camera.{}.encoder.dropped'.format(name))  # 限速/缓冲不足/队列满/ffmpeg 不可用
+        self.restarts = metrics.counter('camera.{}.encoder.restarts'.format(name))
+
+    def out_shape(self, shape: tuple) -> tuple:
+        """保持宽高比、长边为 output_size 的输出尺寸 (h, w, 3), 宽高均为偶数."""
+        h, w = shape[:2]
+        if (h, w) not in self.sizes:
+            r = self.output_size / max(h, w)
+            self.sizes[(h, w)] = (max(2, int(round(h * r / 2)) * 2), max(2, int(round(w * r / 2)) * 2), 3)
+        return self.sizes[(h, w)]
+
+    def acquire(self, shape: tuple):
+        """取一个用于绘制原帧尺寸为 shape 的帧的缓冲, 超出帧率上限或缓冲全部在用时返回 None(丢帧).
+
+        Args:
+            shape (tuple): 原帧尺寸.
+        Returns:
+            np.ndarray: 输出尺寸的 BGR 缓冲, 用后须 put() 或 release().
+        """
+        now = time.time()
+        if now - self.last_accept < self.min_interval:
+            self.dropped.inc()
+            return None
+        out = self.out_shape(shape)
+        if out != self.shape:  # 首帧或帧尺寸变化, 按新尺寸分配缓冲, 旧缓冲归还时丢弃
+            self.shape = out
+            self.pool = deque(np.empty(out, dtype=np.uint8) for _ in range(self.slots))
+        try:
+            buf = self.pool.popleft()
+        except IndexError:
+            self.dropped.inc()
+            return None
+        self.last_accept = now
+        return buf
+
+    def release(self, buf: np.ndarray):
+        """归还帧缓冲."""
+        if buf.shape == self.shape:
+            self.pool.append(buf)
+
+    def put(self, buf: np.ndarray):
+        """送入待编码队列, 队列满时丢弃最旧的帧. 非阻塞."""
+        while True:
+            try:
+                self.queue.put_nowait(buf)
+                return
+            except queue.Full:
+                try:
+                    old = self.queue.get_nowait()
+                except queue.Empty:  # 已被编码线程取走
+                    continue
+                self.dropped.inc()
+                self.release(old)
+
+    def command(self, shape: tuple) -> list:
+        """ffmpeg 运行参数."""
+        f_type = "rtsp" if "rtsp" in self.url else "flv"
+        return ['ffmpeg',
+                '-y',
+                '-f', 'rawvideo',
+                '-vcodec', 'rawvideo',
+                '-pix_fmt', 'bgr24',
+                '-s', "{}x{}".format(shape[1], shape[0]),
+                '-use_wallclock_as_timestamps', '1',  # 时间戳按实际送达时刻, 帧率随实际帧率
+                '-i', '-',
+                '-vsync', 'passthrough',
+                '-c:v', 'libx264',
+                '-pix_fmt', 'yuv420p',
+                '-preset', 'ultrafast',
+                '-tune', 'zerolatency',
+                '-f', f_type,
+                self.url]
+
+    def start(self, shape: tuple) -> bool:
+        """按帧尺寸启动 ffmpeg, 退避期内返回 False."""
+        if time.monotonic() < self.next_start:
+            return False
+        try:
+            self.proc = sp.Popen(self.command(shape), stdin=sp.PIPE)
+        except OSError as err:  # 如找不到 ffmpeg
+            self.logger.error('camera {} ffmpeg 启动失败: {}'.format(self.name, err))
+            self.fail()
+            return False
+        self.proc_shape = shape
+        self.started = time.monotonic()
+        self.logger.info('camera {} ffmpeg 启动, pid={}, 输出 {}x{}.'.format(self.name, self.proc.pid, shape[1], shape[0]))
+        return True
+
+    def stop(self):
+        """关闭 ffmpeg."""
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=2)
+        except sp.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def fail(self):
+        """ffmpeg 异常, 关闭并进入退避. 稳定运行超过最长退避间隔后退避从头计."""
+        self.stop()
+        self.restarts.inc()
+        if time.monotonic() - self.started > self.backoff_max:
+            self.backoff = 1
+        self.next_start = time.monotonic() + self.backoff
+        self.logger.warning('camera {} ffmpeg 异常, {}s 后重启.'.format(self.name, self.backoff))
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+
+    def app(self):
+        """编码线程: 取帧写入 ffmpeg, 监管 ffmpeg 进程."""
+        try:
+            while True:
+                buf = self.queue.get()
+                try:
+                    if self.proc is not None and (self.proc.poll() is not None or self.proc_shape != buf.shape):
+                        if self.proc.poll() is not None:
+                            self.fail()
+                        else:  # 帧尺寸变化(如重连), 按新尺寸重启
+                            self.stop()
+                    if self.proc is None and not self.start(buf.shape):
+                        self.dropped.inc()
+                        continue
+                    self.proc.stdin.write(memoryview(buf).cast('B'))  # 零拷贝
+                    self.written.inc()
+                except (BrokenPipeError, OSError) as err:
+                    self.logger.warning('camera {} 推流写入失败: {}'.format(self.name, err))
+                    self.fail()
+                finally:
+                    self.release(buf)
+        except Exception:
+            self.exc_bucket.put(sys.exc_info())
+
+    def run(self):
+        """启动编码线程."""
+        self.thread = threading.Thread(target=self.app, daemon=True)
+        self.thread.start()
@@ -8,13 +8,15 @@ Time: 2023/8/3
 """
 import cv2
 import logging
-import numpy as np
 import sys
 import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from queue import Queue
-from threading import Lock, Thread
+from threading import Condition, Lock, Thread
+from tools import metrics
+from tools.frame_ring import FrameRing
+from tools.motion import MotionDetector
 from tools.waiting_queue import WaitingQueue
 
 
@@ -27,8 +29,9 @@ class VideoGetter:
         cfg_rtsp (dict): rtsp相关配置.
         channel (str): 视频频道号, 即 camera id.
         max_workers (int): 图片获取线程池最大线程数.
+        ring_slots (int): 帧环槽位数, 帧直接解码到预分配的槽位中.
     """
-    def __init__(self, fps: int, cfg_rtsp: dict, channel: str, exc_bucket, max_workers=3):
+    def __init__(self, fps: int, cfg_rtsp: dict, channel: str, exc_bucket, max_workers=3, ring_slots=32):
         self.fps = fps
         self.cfg_rtsp = cfg_rtsp
         self.channel = channel
@@ -36,15 +39,34 @@ class VideoGetter:
         self.max_workers = max_workers
 
         self.logger = logging.getLogger('log')
-        self.waiting_queue = WaitingQueue(maxsize=3)  # 小一些防止淤积过度造成反应巨慢
+        self.waiting_queue = WaitingQueue(maxsize=3, name='camera.{}.getter'.format(channel),
+            on_drop=lambda item: item[0].release())  # 小一些防止淤积过度造成反应巨慢
 
-        self.frame = None  # app_stream 抓取的每帧图像存于此
+        self.ring_slots = ring_slots
+        self.ring = None  # 帧环, 首帧解码后按帧尺寸创建
+        self.ring_full = metrics.counter('camera.{}.ring_full_drops'.format(channel))
+        self.frames_skipped = metrics.counter('camera.{}.frames_skipped'.format(channel))  # 解码后未被抽取的帧
+        self.frame = None  # app_stream 抓取的最新帧引用(FrameRef)存于此
         self.frametimestamp = time.time()  # 上次抓帧时间
+        self.frame_seq = 0  # 最新帧序号, 每抓到一帧加1
         self.frame_mutex = Lock()
+        self.frame_cond = Condition(self.frame_mutex)  # 新帧到达时通知抽帧线程
         self.cap = None  # 流抓取器
         self.link = ''
 
         self.is_moving = True  # 摄像头下是否运动
+        #运动检测: 静止时只按 KEEPALIVE_FPS 推理, 其余帧沿用上次检测结果
+        cfg_motion = self.cfg_rtsp.get('MOTION', {})
+        self.motion = MotionDetector(
+            width=cfg_motion.get('WIDTH', 160),
+            pixel_thresh=cfg_motion.get('PIXEL_THRESH', 25),
+            min_area=cfg_motion.get('MIN_AREA', 0.002),
+            hold=cfg_motion.get('HOLD_S', 2.0),
+        ) if cfg_motion.get('ENABLE', False) else None
+        keepalive_fps = cfg_motion.get('KEEPALIVE_FPS', 1)
+        self.keepalive = 1 / keepalive_fps if keepalive_fps else float('inf')
+        self.last_infer = 0  # 上次送推理的帧时间
+        self.motion_gated = metrics.counter('camera.{}.motion_gated'.format(channel))  # 因静止跳过推理的帧
 
     def _init_rtsp_link(self):
         """初始化 rtsp 链接."""
@@ -72,29 +94,84 @@ class VideoGetter:
         self.per_score = 1 / 25 * self.fps
         self.frame_count = 1  # 满1则抓一张图. 从1开始可以把第一帧算上
 
-    def _get_img_from_video(self) -> np.ndarray:
-        """[DEBUG] 抓取本地视频的图像帧."""
-        success, frame = self.cap.read()
+    def _get_img_from_video(self):
+        """[DEBUG] 抓取本地视频的图像帧, 跳过的帧只 grab 不解码. 帧环已满时返回 None."""
         while self.frame_count < 1:
             self.frame_count += self.per_score
-            success, frame = self.cap.read()
+            self.cap.grab()
         self.frame_count -= 1
+        success, ref = self.read_frame()
         if not success:
             self.logger.warning('本地视频取完了, 开始阻塞.')
             time.sleep(100000)
             return None
-        return frame
-
-    def fetch_img(self, timestamp: float):
-        """获取一张视频流图片."""
-        with self.frame_mutex:
-            imgarr = self.frame
-            frametimestamp = self.frametimestamp
-        if imgarr is None or timestamp - frametimestamp > 1:  # 图空或抓图卡住
-            self.waiting_queue.removestamp(timestamp)
-        else:
-            self.logger.debug('{} fetched img (time={}).'.format(self.channel, frametimestamp))
-            self.waiting_queue.putitem(timestamp, imgarr)
+        return ref
+
+    def gate(self, ref, timestamp: float) -> bool:
+        """运动门控: 更新 is_moving, 返回该帧是否需要推理.
+
+        运动时每帧都推理; 静止时至少每 keepalive 秒推理一帧, 以发现缓慢进入画面的目标.
+        """
+        if self.motion is None:
+            return True
+        self.is_moving = self.motion.update(ref.frame, timestamp)
+        if self.is_moving or timestamp - self.last_infer >= self.keepalive:
+            self.last_infer = timestamp
+            return True
+        self.motion_gated.inc()
+        return False
+
+    def read_frame(self) -> tuple:
+        """从 cap 解码一帧到帧环的空闲槽位.
+
+        帧环槽位全被下游占用时只 grab 不解码(丢弃本帧), 帧尺寸变化(如重连)时重建帧环.
+
+        Returns:
+            success (bool): 是否取流成功.
+            ref (FrameRef): 帧引用, 调用者为唯一持有者; 丢弃本帧时为 None.
+        """
+        if self.ring is None:
+            success, frame = self.cap.read()
+            if not success:
+                return False, None
+            self.ring = FrameRing(self.ring_slots, frame.shape)
+            ref = self.ring.acquire()
+            self.ring.buffers[ref.slot] = frame
+            return True, ref
+
+        ref = self.ring.acquire()
+        if ref is None:
+            self.ring_full.inc()
+            return self.cap.grab(), None
+        buffer = self.ring.buffers[ref.slot]
+        success, frame = self.cap.read(buffer)
+        if not success:
+            ref.release()
+            return False, None
+        if frame is not buffer:  # 帧尺寸变化, cv2 另行分配了内存
+            ref.release()
+            self.logger.info('摄像头 {} 帧尺寸变为 {}, 重建帧环.'.format(self.channel, frame.shape))
+            self.ring = FrameRing(self.ring_slots, frame.shape)  # 旧帧环在下游释放全部引用后回收
+            ref = self.ring.acquire()
+            self.ring.buffers[ref.slot] = frame
+        return True, ref
+
+    def fetch_img(self, last_seq: int, timeout: float = 1) -> tuple:
+        """等待并获取一张序号晚于 last_seq 的新帧, 不会重复取到同一帧.
+
+        Args:
+            last_seq (int): 上次取到的帧序号.
+            timeout (float): 最长等待秒数.
+        Returns:
+            seq (int): 帧序号, 超时(抓图卡住)为 last_seq.
+            timestamp (float): 抓帧时间.
+            ref (FrameRef): 帧引用, 超时为 None.
+        """
+        with self.frame_cond:
+            if not self.frame_cond.wait_for(lambda: self.frame_seq != last_seq, timeout=timeout):
+                return last_seq, None, None
+            ref = self.frame.retain()  # 须在锁内增加引用, 防止 app_stream 同时释放
+            return self.frame_seq, self.frametimestamp, ref
 
     def app_stream(self):
         """使用该线程不停获取每帧图片, 刷新式存放在 self.frame, app 线程负责隔时取用."""
@@ -138,7 +215,7 @@ class VideoGetter:
                 consiquent_fail = 0  # 连续失败帧数
                 max_consiquent_fail = 250  # 最大连续失败帧数
                 while True:
-                    ret, frame = self.cap.read()
+                    ret, ref = self.read_frame()
                     # 取流失败
                     if not ret:
                         consiquent_fail += 1
@@ -147,27 +224,43 @@ class VideoGetter:
                     # 取流成功
                     else:
                         consiquent_fail = 0
-                        with self.frame_mutex:
-                            self.frame = frame
+                        if ref is None:  # 帧环已满, 本帧已丢弃
+                            continue
+                        with self.frame_cond:
+                            old, self.frame = self.frame, ref
                             self.frametimestamp = time.time()
+                            self.frame_seq += 1
+                            self.frame_cond.notify_all()
+                        if old is not None:
+                            old.release()
             except Exception as err:
                 self.logger.error(f'摄像头 {self.channel} 取流时发生错误: {err}')
                 continue
 
 
     def app(self):
-        """app_stream 线程不停取 rtsp 帧, 本线程隔时拿一帧来."""
+        """app_stream 线程不停取 rtsp 帧, 本线程按 fps 节拍只转发新帧, 以抓帧时间为时间戳.
+
+        摄像头慢于 fps 时每个新帧到达即转发, 快于 fps 时每个节拍取最新一帧.
+        """
         try:
             self._init_rtsp_link()
             delt_sec = 1 / self.fps
+            last_seq = 0
+            next_time = time.monotonic()
             while True:
-                while not self.is_moving:  # 没有运动则等待
-                    time.sleep(0.1)
-        
-                timestamp = time.time()
+                seq, timestamp, ref = self.fetch_img(last_seq)
+                if ref is None:  # 抓图卡住
+                    continue
+                self.frames_skipped.inc(seq - last_seq - 1)
+                last_seq = seq
+                self.logger.debug('{} fetched img (time={}).'.format(self.channel, timestamp))
                 self.waiting_queue.putstamp(timestamp)
-                self.fetch_img(timestamp)
-                time.sleep(delt_sec)
+                self.waiting_queue.putitem(timestamp, (ref, self.gate(ref, timestamp)))
+
+                # 固定节拍, 不因处理耗时累积漂移; 落后超过一拍则重新对齐
+                next_time = max(next_time + delt_sec, time.monotonic())
+                time.sleep(max(0, next_time - time.monotonic()))
         except Exception:
             self.exc_bucket.put(sys.exc_info())
 
@@ -179,8 +272,11 @@ class VideoGetter:
             while True:
                 timestamp = datetime.now().timestamp()
                 self.waiting_queue.putstamp(timestamp)
-                imgarr = self._get_img_from_video()
-                self.waiting_queue.putitem(timestamp, imgarr)
+                ref = self._get_img_from_video()
+                if ref is None:  # 帧环已满
+                    self.waiting_queue.removestamp(timestamp)
+                else:
+                    self.waiting_queue.putitem(timestamp, (ref, self.gate(ref, timestamp)))
                 time.sleep(0.2)
         except Exception:
             self.exc_bucket.put(sys.exc_info())
@@ -206,6 +302,8 @@ class VideoGetter:
             **args: 参数同 Queue.
         Returns:
             timestamp: int.
-            imgarr: np.ndarray.
+            ref (FrameRef): 帧引用, 调用者用完后须 release().
+            infer (bool): 是否需要推理, False 时沿用上次检测结果(运动门控).
         """
-        return self.waiting_queue.get_with_stamp(**args)
+        timestamp, (ref, infer) = self.waiting_queue.get_with_stamp(**args)
+        return timestamp, ref, infer
@@ -6,70 +6,183 @@ Desc: 自定义队列部分
 Author: gaoy
 Time: 2023/8/3
 """
-import heapq
+import bisect
 import logging
 import multiprocessing as mp
 import queue
+import threading
+import time
+from collections import deque
+from tools import metrics
 
 
 class WaitingQueue:
     """为解决多 gpu 返还结果顺序可能不一致问题, 使用该类和时间戳管理以顺序返回结果.
-    
+
+    时间戳按序存于 deque, 到达的项存于字典, 被删除的时间戳只从待到达集合中移除(墓碑), 轮到队首时再弹出,
+    除乱序传入时间戳外各操作均摊 O(1). 线程安全.
+    放出的项先在锁内按序移入待放出队列, 再在锁外放入输出队列, 有界输出队列已满时生产方只阻塞在放入上,
+    不持有状态锁, 消费方的 poll() 不会被其卡住.
+
     Args:
         mode (str): 可选 threading/processing. 创建的队列是线程级还是进程级.
+        name (str): 队列名, 非空时丢弃/跳过计数器注册到指标模块(<name>.removed/skipped/late).
+        max_latency (float): 最大重排等待秒数. 队首时间戳等待超过该时长且其后已有项到达时跳过队首,
+            防止一帧迟迟不归还卡住整条流. None 为一直等待.
+        on_drop (callable): 被丢弃项(跳过后迟到的项)的回调, 用于释放项持有的资源.
+        out_queue: 共享输出队列, 多个等待队列按序放出的项汇入同一队列(如 tools/result_join.py), 放入 (时间戳, 项, tag).
+        tag: 汇入共享输出队列时附带的标记, 如模型名.
         **args: Queue 的参数.
     """
-    def __init__(self, mode='threading', **args):
-        if mode == 'threading':
+    def __init__(self, mode='threading', name=None, max_latency=None, on_drop=None, out_queue=None, tag=None,
+            **args):
+        self.tag = tag
+        if out_queue is not None:
+            self.queue = out_queue
+        elif mode == 'threading':
             self.queue = queue.Queue(**args)
         else:
             mngr = mp.Manager()
             self.queue = mngr.Queue(**args)
         self.logger = logging.getLogger('log')
+        self.name = name
+        self.max_latency = max_latency
+        self.on_drop = on_drop
+
+        self.mutex = threading.Lock()
+        self.stampq = deque()  # 传入时间戳队列, (时间戳, 传入时刻), 按时间戳升序
+        self.pending = set()  # 尚未传入项也未被删除的时间戳
+        self.items = {}  # 已到达但未轮到的项, k=时间戳
+        self.outbox = deque()  # 已按序放出但尚未放入输出队列的项
+        self.out_mutex = threading.Lock()  # 保证待放出项按序放入输出队列
 
-        self.stampq = []  # 传入时间戳队列
-        self.itemq = []
+        counter = metrics.counter if name else metrics.Counter
+        prefix = '{}.'.format(name) if name else ''
+        self.removed = counter(prefix + 'removed')  # 因异常/丢帧删除的时间戳数
+        self.skipped = counter(prefix + 'skipped')  # 等待超时被跳过的时间戳数
+        self.late = counter(prefix + 'late')  # 被跳过后才到达而丢弃的项数
 
     def putstamp(self, stamp: float):
         """1:传入时间戳. 每个待预测图片应先传入时间戳."""
-        if len(self.stampq) == 0 or stamp > self.stampq[-1]:
-            self.stampq.append(stamp)
-        else:
-            self.logger.warning('传入的时间戳({})早于之前最晚时间戳({})! '
-                '现在可以忽略该警报了.这是个理论上不可能出现的问题.'.format(
-                stamp, self.stampq[-1])
-            )
-            self.stampq.append(stamp)
-            self.stampq.sort()
-                
+        with self.mutex:
+            entry = (stamp, time.monotonic())
+            if len(self.stampq) == 0 or stamp > self.stampq[-1][0]:
+                self.stampq.append(entry)
+            else:
+                self.logger.warning('传入的时间戳({})早于之前最晚时间戳({})! '
+                    '现在可以忽略该警报了.这是个理论上不可能出现的问题.'.format(
+                    stamp, self.stampq[-1][0])
+                )
+                self.stampq.insert(bisect.bisect(self.stampq, entry), entry)
+            self.pending.add(stamp)
+
     def putitem(self, itemstamp: float, item):
         """2:传入时间戳和项. 应使用完 putstamp() 方法后使用该方法."""
-
-        heapq.heappush(self.itemq, (itemstamp, item))
-        while len(self.itemq) > 0 and self.stampq[0] == self.itemq[0][0]:
-            self.stampq.pop(0)
-            self.queue.put(heapq.heappop(self.itemq))
+        with self.mutex:
+            if itemstamp not in self.pending:  # 已超时被跳过
+                self.late.inc()
+                if self.on_drop is not None:
+                    self.on_drop(item)
+            else:
+                self.pending.discard(itemstamp)
+                self.items[itemstamp] = item
+            self._flush()
+        self._deliver()
 
     def removestamp(self, stamp: float):
         """2:因异常, 可删除时间戳."""
-        self.stampq.remove(stamp)
+        with self.mutex:
+            if stamp in self.pending:
+                self.pending.discard(stamp)
+                self.removed.inc()
+                self._flush()
+        self._deliver()
+
+    def _flush(self):
+        """按时间戳顺序将已到达的项移入待放出队列, 弹出被删除的时间戳, 跳过等待超时的队首. 需持有锁."""
+        while len(self.stampq) > 0:
+            stamp, put_time = self.stampq[0]
+            if stamp in self.items:
+                self.stampq.popleft()
+                item = self.items.pop(stamp)
+                self.outbox.append((stamp, item) if self.tag is None else (stamp, item, self.tag))
+            elif stamp not in self.pending:  # 墓碑
+                self.stampq.popleft()
+            elif (self.max_latency is not None and len(self.items) > 0
+                    and time.monotonic() - put_time > self.max_latency):
+                self.stampq.popleft()
+                self.pending.discard(stamp)
+                self.skipped.inc()
+            else:
+                break
+
+    def _deliver(self, block=True):
+        """在状态锁外将待放出项按序放入输出队列. 不可持有锁.
+
+        Args:
+            block (bool): 输出队列已满时是否阻塞等待. 消费方调用时为 False: 队列已满或其他线程正在放入时直接返回,
+                剩余的项由生产方或下次 poll() 放入.
+        """
+        if not self.out_mutex.acquire(blocking=block):
+            return
+        try:
+            while True:
+                with self.mutex:
+                    if len(self.outbox) == 0:
+                        return
+                    entry = self.outbox[0]
+                try:
+                    self.queue.put(entry, block=block)
+                except queue.Full:
+                    return
+                with self.mutex:
+                    self.outbox.popleft()
+        finally:
+            self.out_mutex.release()
 
-    def get(self, **args) -> object:
+    def poll(self) -> float:
+        """跳过已等待超时的队首, 返回距队首超时还有多少秒; 无需定时检查(未设置 max_latency 或其后无项)时返回 None.
+
+        结果不再到达时没有 putitem() 触发跳过, 消费方据此定时调用, 超时的队首照常被跳过.
+        """
+        with self.mutex:
+            self._flush()
+            if self.max_latency is None or len(self.items) == 0 or len(self.stampq) == 0:
+                wait = None
+            else:
+                wait = max(0, self.stampq[0][1] + self.max_latency - time.monotonic()) + 0.001
+        self._deliver(block=False)
+        return wait
+
+    def get(self, block=True, timeout=None) -> object:
         """3:获取队列值, 参数同 Queue.
-        
+
         Returns:
             item: object.
         """
-        return self.queue.get(**args)[1]
+        return self.get_with_stamp(block, timeout)[1]
+
+    def get_with_stamp(self, block=True, timeout=None) -> tuple:
+        """3:获取队列戳+值, 参数同 Queue. 等待期间按队首超时时刻调用 poll(), 不依赖新结果到达.
 
-    def get_with_stamp(self, **args) -> tuple:
-        """3:获取队列戳+值, 参数同 Queue.
-        
         Returns:
             timestamp: float.
             item: object.
         """
-        return self.queue.get(**args)
+        if not block:
+            self.poll()
+            return self.queue.get(block=False)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.poll()
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+                wait = remaining if wait is None else min(wait, remaining)
+            try:
+                return self.queue.get(timeout=wait)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
 
     def qsize(self) -> int:
         return self.queue.qsize()
@@ -82,4 +195,24 @@ if __name__ == "__main__":
     wq.putitem(2, 'hello')
     wq.putitem(1, 'hi')
     print(wq.get())
-    print(wq.get())
\ No newline at end of file
+    print(wq.get())
+
+    # 有界输出队列 + 慢消费者: 生产方阻塞在放入上时消费方仍能取出, 顺序不变
+    wq = WaitingQueue(max_latency=0.05, maxsize=3)
+    n = 20
+
+    def produce():
+        for i in range(n):
+            wq.putstamp(i)
+        for i in reversed(range(n)):
+            wq.putitem(i, i)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    got = []
+    for _ in range(n):
+        time.sleep(0.01)
+        got.append(wq.get_with_stamp(timeout=5)[0])
+    producer.join(5)
+    assert got == list(range(n)) and not producer.is_alive(), got
+    print('bounded queue ok')
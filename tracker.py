@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File: tracker.py
+Desc: SORT 风格多目标跟踪(仅依赖 numpy): 全部轨迹的卡尔曼滤波向量化计算, 按 IoU 关联检测框; 检测器可每 N 帧运行一次, 其余帧由轨迹外推补齐
+Author: gaoy
+Time: 2026/10/17
+"""
+import cv2
+import numpy as np
+from tools import detections
+
+# 跟踪结果: 检测结果字段 + 轨迹 id
+TRACK_DTYPE = np.dtype(detections.DET_DTYPE.descr + [('track_id', np.int32)])
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """两组 xyxy 框的两两 IoU, 返回 (len(a), len(b))."""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.nan_to_num(inter / (area_a[:, None] + area_b[None, :] - inter))
+
+
+def xyxy_to_z(boxes: np.ndarray) -> np.ndarray:
+    """xyxy 框转为观测 [cx, cy, s(面积), r(宽高比)]."""
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    return np.stack([boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / np.maximum(h, 1e-6)], axis=1)
+
+
+def x_to_xyxy(x: np.ndarray) -> np.ndarray:
+    """状态 [cx, cy, s, r, ...] 转为 xyxy 框."""
+    w = np.sqrt(np.maximum(x[:, 2] * x[:, 3], 0))
+    h = x[:, 2] / np.maximum(w, 1e-6)
+    return np.stack([x[:, 0] - w / 2, x[:, 1] - h / 2, x[:, 0] + w / 2, x[:, 1] + h / 2], axis=1)
+
+
+def greedy_match(iou: np.ndarray, thres: float) -> np.ndarray:
+    """按 IoU 从高到低贪心匹配, 返回 (k, 2) 的 [轨迹下标, 检测下标], 只保留 IoU 不低于 thres 的对."""
+    rows, cols = np.nonzero(iou >= thres)
+    order = np.argsort(-iou[rows, cols], kind='stable')
+    used_r, used_c, pairs = set(), set(), []
+    for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+        if r not in used_r and c not in used_c:
+            used_r.add(r)
+            used_c.add(c)
+            pairs.append((r, c))
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+class SortTracker:
+    """SORT 风格跟踪器.
+
+    每条轨迹为匀速模型的卡尔曼滤波, 状态 [cx, cy, s, r, vx, vy, vs], 所有轨迹的状态与协方差存于 (n, 7)/(n, 7, 7)
+    数组一次计算. 速度以帧为单位: 每帧调用一次 update()(检测器运行的帧)或 predict()(未运行检测器的帧).
+    只关联同类别的框; 连续 max_age 次检测未匹配的轨迹被删除, 匹配 min_hits 次后才输出(起始阶段除外).
+
+    Args:
+        max_age (int): 轨迹最多允许连续未匹配的检测次数.
+        min_hits (int): 输出前需匹配的检测次数.
+        iou_thres (float): 关联的最小 IoU.
+    """
+    # 常量矩阵, 参数取自 SORT
+    F = np.eye(7) + np.eye(7, k=4)  # 位置 += 速度
+    H = np.eye(4, 7)
+    Q = np.diag([1, 1, 1, 1, 0.01, 0.01, 0.0001])
+    R = np.diag([1, 1, 10, 10])
+    P0 = np.diag([10, 10, 10, 10, 1e4, 1e4, 1e4])  # 新轨迹速度未知, 初始方差大
+
+    def __init__(self, max_age: int = 1, min_hits: int = 3, iou_thres: float = 0.3):
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_thres = iou_thres
+        self.updates = 0  # 已调用 update() 的次数
+        self.next_id = 1
+        self.x = np.zeros((0, 7))
+        self.P = np.zeros((0, 7, 7))
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.hits = np.zeros(0, dtype=np.int32)  # 累计匹配次数
+        self.misses = np.zeros(0, dtype=np.int32)  # 连续未匹配的检测次数
+        self.reported = np.zeros(0, dtype=bool)  # 是否已输出过
+        self.lbls = np.zeros(0, dtype=detections.DET_DTYPE['lbl'])
+        self.confs = np.zeros(0, dtype=np.float32)
+        self.new_ids = np.zeros(0, dtype=np.int32)  # 本帧首次输出的轨迹 id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def step(self):
+        """所有轨迹外推一帧."""
+        shrink = self.x[:, 2] + self.x[:, 6] <= 0  # 面积不能为负
+        self.x[shrink, 6] = 0
+        self.x = self.x @ self.F.T
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+    def correct(self, idx: np.ndarray, z: np.ndarray):
+        """用观测 z 更新轨迹 idx 的状态."""
+        P = self.P[idx]
+        S = self.H @ P @ self.H.T + self.R
+        K = np.linalg.solve(S, self.H @ P).transpose(0, 2, 1)  # P H^T S^-1, S 对称
+        y = z - self.x[idx] @ self.H.T
+        self.x[idx] += np.einsum('nij,nj->ni', K, y)
+        self.P[idx] = (np.eye(7) - K @ self.H) @ P
+
+    def output(self, mask: np.ndarray) -> np.ndarray:
+        """输出 mask 选中的轨迹, 记录其中首次输出的 id."""
+        self.new_ids = self.ids[mask & ~self.reported]
+        self.reported |= mask
+        tracks = np.empty(int(mask.sum()), dtype=TRACK_DTYPE)
+        if len(tracks):
+            tracks['x1'], tracks['y1'], tracks['x2'], tracks['y2'] = np.rint(x_to_xyxy(self.x[mask])).T
+        tracks['lbl'] = self.lbls[mask]
+        tracks['conf'] = self.confs[mask]
+        tracks['track_id'] = self.ids[mask]
+        return tracks
+
+    def confirmed(self) -> np.ndarray:
+        """已达到输出条件的轨迹."""
+        return (self.hits >= self.min_hits) | (self.updates <= self.min_hits)
+
+    def predict(self) -> np.ndarray:
+        """未运行检测器的帧: 外推所有轨迹, 输出上次检测时匹配上的已确认轨迹.
+
+        Returns:
+            np.ndarray: 跟踪结果(TRACK_DTYPE).
+        """
+        self.step()
+        return self.output(self.confirmed() & (self.misses == 0))
+
+    def update(self, dets: np.ndarray) -> np.ndarray:
+        """运行了检测器的帧: 外推后与检测结果关联, 更新匹配的轨迹, 为未匹配的检测新建轨迹, 删除过期轨迹.
+
+        Args:
+            dets (np.ndarray): 检测结果(见 tools/detections.py).
+        Returns:
+            np.ndarray: 本帧匹配上的已确认轨迹(TRACK_DTYPE).
+        """
+        self.updates += 1
+        self.step()
+        boxes = np.stack([dets['x1'], dets['y1'], dets['x2'], dets['y2']], axis=1).astype(np.float64)
+        iou = iou_matrix(x_to_xyxy(self.x), boxes)
+        iou[self.lbls[:, None] != dets['lbl'][None, :]] = 0  # 只关联同类别
+        pairs = greedy_match(iou, self.iou_thres)
+        t, d = pairs[:, 0], pairs[:, 1]
+
+        self.correct(t, xyxy_to_z(boxes[d]))
+        self.confs[t] = dets['conf'][d]
+        matched = np.zeros(len(self), dtype=bool)
+        matched[t] = True
+        self.hits[matched] += 1
+        self.misses[matched] = 0
+        self.misses[~matched] += 1
+
+        new = np.ones(len(dets), dtype=bool)
+        new[d] = False
+        n = int(new.sum())
+        x = np.zeros((n, 7))
+        x[:, :4] = xyxy_to_z(boxes[new])
+        self.x = np.concatenate([self.x, x])
+        self.P = np.concatenate([self.P, np.broadcast_to(self.P0, (n, 7, 7))])
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n, dtype=np.int32)])
+        self.next_id += n
+        self.hits = np.concatenate([self.hits, np.ones(n, dtype=np.int32)])
+        self.misses = np.concatenate([self.misses, np.zeros(n, dtype=np.int32)])
+        self.reported = np.concatenate([self.reported, np.zeros(n, dtype=bool)])
+        self.lbls = np.concatenate([self.lbls, dets['lbl'][new]])
+        self.confs = np.concatenate([self.confs, dets['conf'][new]])
+
+        alive = self.misses <= self.max_age
+        for name in ('x', 'P', 'ids', 'hits', 'misses', 'reported', 'lbls', 'confs'):
+            setattr(self, name, getattr(self, name)[alive])
+        return self.output(self.confirmed() & (self.misses == 0))
+
+
+def draw_tracks(image, tracks, line_thickness=None):
+    """
+    绘制跟踪框与轨迹 id
+    Args:
+        image: 输入图像
+        tracks: 跟踪结果(TRACK_DTYPE)
+        line_thickness: 线条宽度
+    """
+    tl = line_thickness or round(0.002 * (image.shape[0] + image.shape[1]) / 2) + 1
+    tf = max(tl - 1, 1)
+    for x1, y1, x2, y2, lbl, _, track_id in tracks.tolist():
+        cv2.rectangle(image, (x1, y1), (x2, y2), [0, 255, 0], thickness=tl, lineType=cv2.LINE_AA)
+        label = '{} ID-{}'.format(lbl, track_id)
+        t_size = cv2.getTextSize(label, 0, fontScale=tl / 3, thickness=tf)[0]
+        cv2.rectangle(image, (x1, y1 - t_size[1] - 3), (x1 + t_size[0], y1), [0, 0, 0], -1, cv2.LINE_AA)
+        cv2.putText(image, label, (x1, y1 - 2), 0, tl / 3, [255, 255, 255], thickness=tf, lineType=cv2.LINE_AA)
+    return image
+
+
+def update_tracker(target_detector, image):
+    """
+    baseDet.feedCap 的跟踪入口: 每 detect_interval 帧运行一次检测器并关联, 其余帧由轨迹外推
+    Args:
+        target_detector: 检测器(utils/BaseDetector.baseDet), 跟踪器存于其 tracker 属性, 首次调用时创建
+        image: 当前帧, 不被修改(可为只读/共享的帧环视图)
+    Returns:
+        image: 绘制了跟踪框的帧副本
+        new_faces: 本帧新出现目标的裁剪图
+        face_bboxes: 新出现目标的框 (x1, y1, x2, y2)
+        bboxes2draw: 本帧跟踪结果(TRACK_DTYPE)
+    """
+    tracker = getattr(target_detector, 'tracker', None)
+    if tracker is None:
+        tracker = target_detector.tracker = SortTracker(
+            max_age=getattr(target_detector, 'track_max_age', 1),
+            min_hits=getattr(target_detector, 'track_min_hits', 3),
+            iou_thres=getattr(target_detector, 'track_iou_thres', 0.3))
+    interval = max(1, getattr(target_detector, 'detect_interval', 1))
+
+    if (target_detector.frameCounter - 1) % interval == 0:
+        _, dets = target_detector.detect(image)
+        bboxes2draw = tracker.update(dets)
+    else:
+        bboxes2draw = tracker.predict()
+
+    h, w = image.shape[:2]
+    for k, limit in (('x1', w), ('y1', h), ('x2', w), ('y2', h)):
+        np.clip(bboxes2draw[k], 0, limit - 1, out=bboxes2draw[k])
+
+    new_faces, face_bboxes = [], []
+    for x1, y1, x2, y2 in bboxes2draw[np.isin(bboxes2draw['track_id'], tracker.new_ids)][['x1', 'y1', 'x2', 'y2']].tolist():
+        new_faces.append(image[y1:y2, x1:x2].copy())  # 拷贝, 不引用调用方的帧
+        face_bboxes.append((x1, y1, x2, y2))
+
+    image = draw_tracks(image.copy(), bboxes2draw)  # 在副本上绘制, 输入帧可能只读或仍被他处使用
+    return image, new_faces, face_bboxes, bboxes2draw
@@ -9,6 +9,7 @@ class baseDet(object):
         self.img_size = 640
         self.threshold = 0.3
         self.stride = 1
+        self.detect_interval = 1  # run the detector every N frames, the tracker extrapolates in between
 
     def build_config(self):
 
@@ -19,6 +20,7 @@ class baseDet(object):
         self.frameCounter = 0
         self.currentCarID = 0
         self.recorded = []
+        self.tracker = None  # tracker.SortTracker, created by update_tracker on first use
 
         self.font = cv2.FONT_HERSHEY_SIMPLEX
 
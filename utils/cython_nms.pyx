@@ -7,11 +7,16 @@
 # Licensed under The MIT License [see LICENSE for details]
 # Written by Ross Girshick
 # --------------------------------------------------------
+#
+# Built on first use by utils/nms.py (pyximport). Same semantics as torchvision.ops.nms: continuous coordinates
+# (no +1), boxes suppressed when IoU > thresh, kept indices returned in decreasing score order.
 
 cimport cython
 import numpy as np
 cimport numpy as np
 
+np.import_array()
+
 cdef inline np.float32_t max(np.float32_t a, np.float32_t b) nogil:
     return a if a >= b else b
 
@@ -22,18 +27,19 @@ cdef inline np.float32_t min(np.float32_t a, np.float32_t b) nogil:
 @cython.cdivision(True)
 @cython.wraparound(False)
 def nms(np.ndarray[np.float32_t, ndim=2] dets, np.float32_t thresh):
-    cdef np.ndarray[np.float32_t, ndim=1] x1 = dets[:, 0]
-    cdef np.ndarray[np.float32_t, ndim=1] y1 = dets[:, 1]
-    cdef np.ndarray[np.float32_t, ndim=1] x2 = dets[:, 2]
-    cdef np.ndarray[np.float32_t, ndim=1] y2 = dets[:, 3]
-    cdef np.ndarray[np.float32_t, ndim=1] scores = dets[:, 4]
+    cdef np.ndarray[np.float32_t, ndim=1] x1 = np.ascontiguousarray(dets[:, 0])
+    cdef np.ndarray[np.float32_t, ndim=1] y1 = np.ascontiguousarray(dets[:, 1])
+    cdef np.ndarray[np.float32_t, ndim=1] x2 = np.ascontiguousarray(dets[:, 2])
+    cdef np.ndarray[np.float32_t, ndim=1] y2 = np.ascontiguousarray(dets[:, 3])
+    cdef np.ndarray[np.float32_t, ndim=1] scores = np.ascontiguousarray(dets[:, 4])
 
-    cdef np.ndarray[np.float32_t, ndim=1] areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-    cdef np.ndarray[np.int64_t, ndim=1] order = scores.argsort()[::-1]
+    cdef np.ndarray[np.float32_t, ndim=1] areas = (x2 - x1) * (y2 - y1)
+    cdef np.ndarray[np.int64_t, ndim=1] order = np.argsort(-scores, kind='stable').astype(np.int64)
 
     cdef int ndets = dets.shape[0]
-    cdef np.ndarray[np.int_t, ndim=1] suppressed = \
-            np.zeros((ndets), dtype=np.int)
+    cdef np.ndarray[np.uint8_t, ndim=1] suppressed = np.zeros(ndets, dtype=np.uint8)
+    cdef np.ndarray[np.int64_t, ndim=1] keep = np.empty(ndets, dtype=np.int64)
+    cdef int nkeep = 0
 
     # nominal indices
     cdef int _i, _j
@@ -51,6 +57,8 @@ def nms(np.ndarray[np.float32_t, ndim=2] dets, np.float32_t thresh):
           i = order[_i]
           if suppressed[i] == 1:
               continue
+          keep[nkeep] = i
+          nkeep += 1
           ix1 = x1[i]
           iy1 = y1[i]
           ix2 = x2[i]
@@ -64,11 +72,11 @@ def nms(np.ndarray[np.float32_t, ndim=2] dets, np.float32_t thresh):
               yy1 = max(iy1, y1[j])
               xx2 = min(ix2, x2[j])
               yy2 = min(iy2, y2[j])
-              w = max(0.0, xx2 - xx1 + 1)
-              h = max(0.0, yy2 - yy1 + 1)
+              w = max(0.0, xx2 - xx1)
+              h = max(0.0, yy2 - yy1)
               inter = w * h
               ovr = inter / (iarea + areas[j] - inter)
-              if ovr >= thresh:
+              if ovr > thresh:
                   suppressed[j] = 1
 
-    return np.where(suppressed == 0)[0]
+    return keep[:nkeep]
@@ -13,19 +13,15 @@ from pathlib import Path
 
 import cv2
 import numpy as np
-import pandas as pd
 import torch
-import torchvision
 import yaml
 
-from utils.google_utils import gsutil_getsize
-from utils.metrics import fitness
-from utils.torch_utils import init_torch_seeds
+from utils.nms import get_engine
+from utils.torch_utils import init_torch_seeds, time_synchronized
 
 # Settings
 torch.set_printoptions(linewidth=320, precision=5, profile='long')
 np.set_printoptions(linewidth=320, formatter={'float_kind': '{:11.5g}'.format})  # format short g, %precision=5
-pd.options.display.max_columns = 10
 cv2.setNumThreads(0)  # prevent OpenCV from multithreading (incompatible with PyTorch DataLoader)
 os.environ['NUMEXPR_MAX_THREADS'] = str(min(os.cpu_count(), 8))  # NumExpr max threads
 
@@ -419,8 +415,8 @@ def wh_iou(wh1, wh2):
 
 
 def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False,
-                        labels=()):
-    """Runs Non-Maximum Suppression (NMS) on inference results
+                        labels=(), engine='auto'):
+    """Runs Non-Maximum Suppression (NMS) on inference results, engine selects the NMS kernel (see utils/nms.py)
 
     Returns:
          list of detections, on (n,6) tensor per image [xyxy, conf, cls]
@@ -432,12 +428,13 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
     # Settings
     min_wh, max_wh = 2, 4096  # (pixels) minimum and maximum box width and height
     max_det = 300  # maximum number of detections per image
-    max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
+    max_nms = 30000  # maximum number of boxes into nms()
     time_limit = 10.0  # seconds to quit after
     redundant = True  # require redundant detections
     multi_label &= nc > 1  # multiple labels per box (adds 0.5ms/img)
     merge = False  # use merge-NMS
 
+    nms = get_engine(engine)
     t = time.time()
     output = [torch.zeros((0, 6), device=prediction.device)] * prediction.shape[0]
     for xi, x in enumerate(prediction):  # image index, image inference
@@ -490,7 +487,7 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
         # Batched NMS
         c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
         boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
-        i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
+        i = nms(boxes, scores, iou_thres)  # NMS
         if i.shape[0] > max_det:  # limit detections
             i = i[:max_det]
         if merge and (1 < n < 3E3):  # Merge NMS (boxes merged using weighted mean)
@@ -509,6 +506,52 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
     return output
 
 
+def fast_non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, topk=1000,
+                             max_det=300, engine='auto', timings=None):
+    """Batched NMS fast path for inference: takes each box's best class, drops boxes whose best class is not wanted,
+    keeps the top-k candidates per image with torch.topk instead of a full sort, then runs one NMS call over the whole
+    batch (boxes offset per image and class). Same output as non_max_suppression() when topk >= candidates
+
+    Arguments:
+        classes: class indices to keep, None for all
+        topk: maximum candidates per image into NMS
+        timings: optional dict, filled with per-stage milliseconds ('candidates', 'nms')
+
+    Returns:
+         list of detections, on (n,6) tensor per image [xyxy, conf, cls]
+    """
+    t0 = time_synchronized() if timings is not None else 0
+    bs, n = prediction.shape[:2]
+    max_wh = 4096  # (pixels) maximum box width and height
+    nc = prediction.shape[2] - 5  # number of classes
+    conf, j = (prediction[..., 5:] * prediction[..., 4:5]).max(2)  # conf = obj_conf * cls_conf, best class (bs, n)
+    if classes is not None:  # filter on the best class over all classes, like non_max_suppression()
+        wanted = (j[..., None] == torch.as_tensor(classes, device=prediction.device)).any(2)
+        conf = conf.masked_fill(~wanted, -1)  # never above conf_thres, never in the top-k ahead of a wanted box
+
+    k = min(topk, n)
+    conf, idx = conf.topk(k, 1)  # (bs, k)
+    idx, order = idx.sort(1)  # back to anchor order, so that NMS breaks confidence ties like the full path
+    conf = conf.gather(1, order)
+    b, m = (conf > conf_thres).nonzero(as_tuple=True)  # image index, position of each candidate
+    idx = idx[b, m]
+    box = xywh2xyxy(prediction[b, idx, :4])
+    j = j[b, idx]
+    x = torch.cat((box, conf[b, m, None], j[:, None].float()), 1)  # image-major
+    if timings is not None:
+        t1 = time_synchronized()
+        timings['candidates'] = (t1 - t0) * 1000
+
+    group = b if agnostic else b * nc + j  # NMS group per image (and class), small offsets keep fp32 precision
+    i = get_engine(engine)(x[:, :4] + group[:, None] * max_wh, x[:, 4], iou_thres)  # NMS, in confidence order
+    i = i[torch.argsort(b[i], stable=True)]  # image-major, confidence order within each image
+    counts = torch.bincount(b[i], minlength=bs).tolist()
+    output = [d[:max_det] for d in x[i].split(counts)]
+    if timings is not None:
+        timings['nms'] = (time_synchronized() - t1) * 1000
+    return output
+
+
 def strip_optimizer(f='best.pt', s=''):  # from utils.general import *; strip_optimizer()
     # Strip optimizer from 'f' to finalize training, optionally save as 's'
     x = torch.load(f, map_location=torch.device('cpu'))
@@ -531,6 +574,8 @@ def print_mutation(hyp, results, yaml_file='hyp_evolved.yaml', bucket=''):
     b = '%10.3g' * len(hyp) % tuple(hyp.values())  # hyperparam values
     c = '%10.4g' * len(results) % results  # results (P, R, mAP@0.5, mAP@0.5:0.95, val_losses x 3)
     print('\n%s\n%s\nEvolved fitness: %s\n' % (a, b, c))
+    from utils.google_utils import gsutil_getsize
+    from utils.metrics import fitness
 
     if bucket:
         url = 'gs://%s/evolve.txt' % bucket
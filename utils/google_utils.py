@@ -6,7 +6,6 @@ import subprocess
 import time
 from pathlib import Path
 
-import requests
 import torch
 
 
@@ -18,10 +17,13 @@ def gsutil_getsize(url=''):
 
 def attempt_download(file, repo='ultralytics/yolov5'):
     # Attempt file download if does not exist
+    if Path(str(file).strip().replace("'", '')).exists():  # local file, no network access
+        return
     file = Path(str(file).strip().replace("'", '').lower())
 
     if not file.exists():
         try:
+            import requests
             response = requests.get(f'https://api.github.com/repos/{repo}/releases/latest').json()  # github api
             assets = [x['name'] for x in response['assets']]  # release assets, i.e. ['yolov5s.pt', 'yolov5m.pt', ...]
             tag = response['tag_name']  # i.e. 'v1.0'
@@ -0,0 +1,167 @@
+# NMS engines: torchvision.ops.nms, Cython (utils/cython_nms.pyx) and vectorized NumPy
+#
+# Every engine takes boxes (n,4) xyxy and scores (n,) tensors plus an IoU threshold and returns the kept indices as a
+# long tensor on the boxes' device, in decreasing score order, suppressing boxes with IoU > threshold. The numpy engine
+# needs neither torchvision nor a compiler, for CPU deployments without them. Benchmark and cross-check the engines,
+# and check utils.general.fast_non_max_suppression against non_max_suppression (with and without class filtering):
+#   $ export PYTHONPATH="$PWD" && python utils/nms.py --counts 100 1000 10000 --iou 0.3 0.45 0.6
+
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+ENGINE_ORDER = ('torchvision', 'cython', 'numpy')  # 'auto' picks the first available
+_engines = {}  # resolved engines, k=name
+
+
+def nms_numpy(boxes, scores, iou_thres):
+    # Greedy NMS, each step compares the current best box against all remaining boxes at once (float32 like torchvision)
+    b = boxes.detach().float().cpu().numpy()
+    s = scores.detach().float().cpu().numpy()
+    x1, y1, x2, y2 = b.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-s, kind='stable')
+    keep = []
+    with np.errstate(divide='ignore', invalid='ignore'):  # zero-area boxes give nan IoU, never suppressed
+        while order.size:
+            i, rest = order[0], order[1:]
+            keep.append(i)
+            w = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+            h = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+            inter = w * h
+            iou = inter / (areas[i] + areas[rest] - inter)
+            order = rest[~(iou > iou_thres)]
+    return torch.as_tensor(np.array(keep, dtype=np.int64), device=boxes.device)
+
+
+def _torchvision():
+    import torchvision  # slow import, only when selected
+
+    return torchvision.ops.nms
+
+
+def _cython():
+    import pyximport  # Cython, compiles utils/cython_nms.pyx into ~/.pyxbld on first use
+
+    pyximport.install(setup_args={'include_dirs': np.get_include()}, language_level=3)
+    from utils.cython_nms import nms
+
+    def nms_cython(boxes, scores, iou_thres):
+        dets = torch.cat((boxes.detach().float(), scores.detach().float()[:, None]), 1).cpu().numpy()
+        return torch.as_tensor(nms(dets, np.float32(iou_thres)), device=boxes.device)
+
+    return nms_cython
+
+
+_LOADERS = {'torchvision': _torchvision, 'cython': _cython, 'numpy': lambda: nms_numpy}
+
+
+def get_engine(name='auto'):
+    # Returns the NMS function for engine name (torchvision, cython, numpy or auto), resolved once per process
+    name = (name or 'auto').lower()
+    if name not in _engines:
+        if name == 'auto':
+            for n in ENGINE_ORDER:
+                try:
+                    _engines[name] = get_engine(n)
+                    logger.info(f'NMS engine: {n}')
+                    break
+                except Exception as e:
+                    logger.info(f'NMS engine {n} unavailable: {e}')
+        else:
+            assert name in _LOADERS, f'unknown NMS engine {name}, choose from {list(_LOADERS)} or auto'
+            _engines[name] = _LOADERS[name]()
+    return _engines[name]
+
+
+def random_boxes(n, size=640, cluster=8, seed=0):
+    # Returns n random xyxy boxes and scores, grouped around n/cluster centres so that NMS has overlaps to suppress
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform(0, size, (max(1, n // cluster), 2))[rng.integers(0, max(1, n // cluster), n)]
+    xy = centres + rng.normal(0, 8, (n, 2))
+    wh = rng.uniform(10, 200, (n, 2))
+    boxes = np.concatenate((xy - wh / 2, xy + wh / 2), 1).astype(np.float32)
+    return torch.from_numpy(boxes), torch.from_numpy(rng.random(n, dtype=np.float32))
+
+
+def benchmark(engines, counts=(100, 1000, 10000), thresholds=(0.3, 0.45, 0.6), n=10, device='cpu'):
+    # Times each engine over box counts x IoU thresholds, checks the kept indices equal the first engine's.
+    # Returns rows (engine, count, iou, ms, kept, match)
+    rows = []
+    for count in counts:
+        boxes, scores = (x.to(device) for x in random_boxes(count))
+        for iou in thresholds:
+            reference = None
+            for name in engines:
+                nms = get_engine(name)
+                nms(boxes, scores, iou)  # warmup (cython build, cuda init)
+                t = time.perf_counter()
+                for _ in range(n):
+                    keep = nms(boxes, scores, iou)
+                dt = (time.perf_counter() - t) / n * 1000
+                reference = keep if reference is None else reference
+                rows.append((name, count, iou, dt, len(keep), torch.equal(keep.cpu(), reference.cpu())))
+    return rows
+
+
+def random_predictions(bs=3, n=6300, nc=80, size=640, seed=0):
+    # Returns random raw model output (bs, n, 5+nc) [xywh, obj, cls...] with overlapping boxes, for NMS cross-checks
+    boxes, _ = random_boxes(bs * n, size=size, seed=seed)
+    xywh = torch.cat(((boxes[:, :2] + boxes[:, 2:]) / 2, boxes[:, 2:] - boxes[:, :2]), 1)
+    scores = torch.from_numpy(np.random.default_rng(seed).random((bs * n, 1 + nc), dtype=np.float32))
+    return torch.cat((xywh, scores), 1).view(bs, n, 5 + nc)
+
+
+def check_fast_nms(engine='auto', class_sets=(None, [0], [0, 2]), agnostic=(False, True)):
+    # Checks fast_non_max_suppression() (with topk covering all candidates) matches non_max_suppression().
+    # Returns rows (classes, agnostic, boxes per image, match)
+    from utils.general import fast_non_max_suppression, non_max_suppression
+
+    prediction = random_predictions()
+    rows = []
+    for classes in class_sets:
+        for a in agnostic:
+            ref = non_max_suppression(prediction.clone(), 0.25, 0.45, classes=classes, agnostic=a, engine=engine)
+            out = fast_non_max_suppression(prediction.clone(), 0.25, 0.45, classes=classes, agnostic=a,
+                                           topk=prediction.shape[1], engine=engine)
+            match = all(torch.equal(r, o) for r, o in zip(ref, out))
+            rows.append((str(classes), a, [len(o) for o in out], match))
+    return rows
+
+
+if __name__ == '__main__':
+    sys.path.append('./')  # to run '$ python *.py' files in subdirectories
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engines', nargs='+', default=list(ENGINE_ORDER), help='engines, first is the reference')
+    parser.add_argument('--counts', nargs='+', type=int, default=[100, 1000, 10000], help='boxes per image')
+    parser.add_argument('--iou', nargs='+', type=float, default=[0.3, 0.45, 0.6], help='IoU thresholds')
+    parser.add_argument('--n', type=int, default=10, help='timed iterations')
+    parser.add_argument('--device', default='cpu', help='cpu or cuda:0 (torchvision runs on device, others on cpu)')
+    opt = parser.parse_args()
+    print(opt)
+
+    engines = []
+    for name in opt.engines:
+        try:
+            get_engine(name)
+            engines.append(name)
+        except Exception as e:
+            print(f'{name} unavailable: {e}')
+
+    rows = benchmark(engines, opt.counts, opt.iou, opt.n, opt.device)
+    print('\n%12s%8s%6s%12s%8s%8s' % ('engine', 'boxes', 'iou', 'time(ms)', 'kept', 'match'))
+    for r in rows:
+        print('%12s%8g%6g%12.3f%8g%8s' % r)
+    assert all(r[-1] for r in rows), 'NMS engines disagree'
+
+    rows = check_fast_nms(engines[0])
+    print('\n%12s%10s%16s%8s' % ('classes', 'agnostic', 'boxes', 'match'))
+    for r in rows:
+        print('%12s%10s%16s%8s' % r)
+    assert all(r[-1] for r in rows), 'fast_non_max_suppression disagrees with non_max_suppression'
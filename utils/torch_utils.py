@@ -15,7 +15,6 @@ import torch
 import torch.backends.cudnn as cudnn
 import torch.nn as nn
 import torch.nn.functional as F
-import torchvision
 
 try:
     import thop  # for FLOPS computation
@@ -227,6 +226,7 @@ def model_info(model, verbose=False, img_size=640):
 
 def load_classifier(name='resnet101', n=2):
     # Loads a pretrained model reshaped to n-class output
+    import torchvision
     model = torchvision.models.__dict__[name](pretrained=True)
 
     # ResNet model properties